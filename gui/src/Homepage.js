@@ -4,6 +4,8 @@ import EvaluationBar from './home_components/EvaluationBar';
 import MenuBar from './home_components/MenuBar';
 import SidePanel from './home_components/SidePanel';
 import BottomPanel from './home_components/BottomPanel';
+import { applyTreePatch } from './home_components/gameTreePatch';
+import { apiUrl, websocketUrl } from './session';
 import { Box } from '@mui/material';
 
 function Homepage() {
@@ -12,7 +14,9 @@ function Homepage() {
   const [orientation, setOrientation] = useState('white');
   const [gameTree, setGameTree] = useState(null);
   const [evaluationScore, setEvaluationScore] = useState(0);
+  const [bookMoves, setBookMoves] = useState([]);
   const websocket = useRef(null);
+  const gameTreeRef = useRef(null);
 
   const flipBoard = () => {
     setOrientation(orientation === 'white' ? 'black' : 'white');
@@ -21,7 +25,7 @@ function Homepage() {
   useEffect(() => {
     const fetchCurrentFen = async () => {
       try {
-        const response = await fetch('http://localhost:5000/current_fen');
+        const response = await fetch(apiUrl('/current_fen'));
         const data = await response.json();
         console.log("Fetched FEN:", data.fen);
         if (data.fen) {
@@ -40,17 +44,32 @@ function Homepage() {
   }, []);
 
   useEffect(() => {
-    websocket.current = new WebSocket('ws://localhost:5000/ws');
+    websocket.current = new WebSocket(websocketUrl('/ws'));
 
     websocket.current.onmessage = function(event) {
       const data = JSON.parse(event.data);
       // console.log("Received data from WebSocket:", event.data);
       if (data.fen) {
         setBoardPosition(data.fen);
+        setBookMoves([]);
       } else if (data.game_tree) {
-        setGameTree(JSON.parse(data.game_tree)); // Update the game tree data
+        gameTreeRef.current = data.game_tree; // Full snapshot replaces the tree
+        setGameTree(data.game_tree.tree);
+      } else if (data.game_tree_patch) {
+        const patched = applyTreePatch(gameTreeRef.current, data.game_tree_patch);
+        if (patched) {
+          gameTreeRef.current = patched;
+          setGameTree(patched.tree);
+        } else {
+          websocket.current.send(JSON.stringify({ tree_snapshot: true }));
+        }
+      } else if (data.book_moves) {
+        // Book position: no engine eval follows, so the bar goes back to level and the panel lists the book
+        setEvaluationScore(0);
+        setBookMoves(data.book_moves);
       } else if (data.value) {
         setEvaluationScore(data.value);
+        setBookMoves([]);
       } else if (data.error) {
         console.error('Illegal move or error:', data.error);
       }
@@ -78,7 +97,7 @@ function Homepage() {
 
   const resetBoard = async () => {
     try {
-      const response = await fetch('http://localhost:5000/reset', { method: 'POST' });
+      const response = await fetch(apiUrl('/reset'), { method: 'POST' });
       const data = await response.json();
       if (data.fen) {
         setBoardPosition(data.fen); // Update the board position with the new FEN
@@ -92,7 +111,7 @@ function Homepage() {
 
   const navigateForward = async () => {
     try {
-      const response = await fetch('http://localhost:5000/navigate_forward', { method: 'POST' });
+      const response = await fetch(apiUrl('/navigate_forward'), { method: 'POST' });
       const data = await response.json();
       if (data.fen) {
         setBoardPosition(data.fen);
@@ -106,7 +125,7 @@ function Homepage() {
   
   const navigateBackward = async () => {
     try {
-      const response = await fetch('http://localhost:5000/navigate_backward', { method: 'POST' });
+      const response = await fetch(apiUrl('/navigate_backward'), { method: 'POST' });
       const data = await response.json();
       if (data.fen) {
         setBoardPosition(data.fen);
@@ -139,6 +158,7 @@ function Homepage() {
           <Box sx={{ pl: 2, display: 'flex', flexDirection: 'column', minHeight: '600px' }}>
             <SidePanel
               gameTree={gameTree}
+              bookMoves={bookMoves}
             />
           </Box>
         </Box>
@@ -1,12 +1,13 @@
 import React, { useState } from 'react';
 import { Dialog, DialogContent, DialogTitle, TextField, ButtonGroup, Button } from '@mui/material';
+import { apiUrl } from '../session';
 
 function NewGamePopup({ open, handleClose }) {
   const [pgn, setPgn] = useState('');
 
   const handleSubmit = async () => {
     try {
-      const response = await fetch('http://localhost:5000/pgn', {
+      const response = await fetch(apiUrl('/pgn'), {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
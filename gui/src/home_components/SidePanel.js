@@ -17,7 +17,7 @@ const rows = [
   // Add more rows as needed
 ];
 
-function SidePanel({ gameTree }) {
+function SidePanel({ gameTree, bookMoves = [] }) {
   const [selectedTab, setSelectedTab] = useState(0);
 
   const handleChange = (event, newValue) => {
@@ -69,7 +69,14 @@ function SidePanel({ gameTree }) {
             <TableContainer component={Paper}>
               <Table size="small" aria-label="a dense table">
                 <TableBody>
-                  {rows.map((row) => (
+                  {bookMoves.length > 0 ? bookMoves.map((bookMove) => (
+                    <TableRow key={bookMove.move}>
+                      <TableCell component="th" scope="row">
+                        {bookMove.san}
+                      </TableCell>
+                      <TableCell align="right">{(bookMove.share * 100).toFixed(1)}%</TableCell>
+                    </TableRow>
+                  )) : rows.map((row) => (
                     <TableRow key={row.evaluation}>
                       <TableCell component="th" scope="row">
                         {row.line}
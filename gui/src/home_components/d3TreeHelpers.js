@@ -1,10 +1,10 @@
 import * as d3 from 'd3';
 
 export function initializeTree(data, svg, dimensions) {
-    // Assign unique identifiers to each node
+    // Assign unique identifiers to each node, keeping the server's path ids when present
     let id = 0;
     const assignIds = (node, depth) => {
-        node.id = `${depth}-${node.name}-${id++}`;
+        node.id = node.id ?? `${depth}-${node.name}-${id++}`;
         if (node.children) {
             node.children.forEach(child => assignIds(child, depth + 1));
         }
@@ -52,7 +52,9 @@ export function updateNodes(root, svg) {
               .attr('transform', d => `translate(${d.x},${d.y})`);
 
     nodeUpdate.select('circle').attr('r', 5);
-    nodeUpdate.select('text').style('font-size', '10px');
+    nodeUpdate.select('text')
+              .style('font-size', '10px')
+              .text(d => d.data.eval ? `${d.data.name} ${formatEval(d.data.eval)}` : d.data.name);
 
     // Remove any exiting nodes
     nodes.exit().transition().duration(500)
@@ -82,4 +84,11 @@ export function updateLinks(root, svg) {
 
     // Remove any exiting links
     links.exit().transition().duration(500).remove();
-}
\ No newline at end of file
+}
+function formatEval(evaluation) {
+    if (evaluation.mate !== null && evaluation.mate !== undefined) {
+        return `M${evaluation.mate}`;
+    }
+    const pawns = evaluation.cp / 100;
+    return pawns > 0 ? `+${pawns.toFixed(1)}` : pawns.toFixed(1);
+}
@@ -0,0 +1,57 @@
+// Applies an incremental patch from the server to the current game tree.
+// Returns a new root so React picks up the change, or null if the patch
+// cannot be applied (sequence gap or unknown node) and a resync is needed.
+export function applyTreePatch(tree, patch) {
+    if (tree && patch.seq <= tree.seq) {
+        return tree; // Already part of the snapshot we hold
+    }
+    if (!tree || patch.seq !== tree.seq + 1) {
+        return null;
+    }
+
+    const root = { ...tree.tree };
+    const parent = findNode(root, patch.parent);
+    if (!parent) {
+        return null;
+    }
+
+    if (patch.type === 'add') {
+        const child = { id: patch.id, name: patch.name, children: [] };
+        parent.children.splice(patch.index, 0, child);
+    } else if (patch.type === 'remove') {
+        parent.children = parent.children.filter(child => child.id !== patch.id);
+    } else if (patch.type === 'promote') {
+        const current = parent.children.findIndex(child => child.id === patch.id);
+        if (current === -1) {
+            return null;
+        }
+        const [child] = parent.children.splice(current, 1);
+        parent.children.splice(patch.index, 0, child);
+    } else if (patch.type === 'eval') {
+        const index = parent.children.findIndex(child => child.id === patch.id);
+        if (index === -1) {
+            return null;
+        }
+        parent.children[index] = { ...parent.children[index], eval: patch.eval };
+    }
+
+    return { seq: patch.seq, tree: root };
+}
+
+function findNode(root, id) {
+    if (id === '') {
+        return root;
+    }
+
+    // Node ids are the UCI path from the root, so walk one move at a time
+    let node = root;
+    let path = '';
+    for (const move of id.split(' ')) {
+        path = path ? `${path} ${move}` : move;
+        node = node.children.find(child => child.id === path);
+        if (!node) {
+            return null;
+        }
+    }
+    return node;
+}
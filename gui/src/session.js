@@ -0,0 +1,23 @@
+// Every browser tab gets its own board on the server. The id lives in sessionStorage, so it
+// survives reloads of the tab but is not shared with other tabs.
+const SERVER = 'localhost:5000';
+const STORAGE_KEY = 'shiro-session';
+
+export function sessionId() {
+  let id = sessionStorage.getItem(STORAGE_KEY);
+  if (!id) {
+    id = window.crypto && window.crypto.randomUUID
+      ? window.crypto.randomUUID()
+      : `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}`;
+    sessionStorage.setItem(STORAGE_KEY, id);
+  }
+  return id;
+}
+
+export function apiUrl(route) {
+  return `http://${SERVER}${route}?session=${encodeURIComponent(sessionId())}`;
+}
+
+export function websocketUrl(route) {
+  return `ws://${SERVER}${route}?session=${encodeURIComponent(sessionId())}`;
+}
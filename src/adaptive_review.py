@@ -0,0 +1,107 @@
+import asyncio
+import logging
+import chess.engine
+
+
+class AdaptiveReview:
+    def __init__(self, analyse, time_budget=None, node_budget=None, shallow_depth=10, max_depth=22,
+                 depth_step=4, swing_threshold=50, decided_cp=600, concurrency=1):
+        self.logger = logging.getLogger(__name__)
+        self.analyse = analyse  # Coroutine function (board, limit) -> engine info
+        self.time_budget = time_budget  # Seconds for the whole game, shallow pass included
+        self.node_budget = node_budget  # Engine nodes for the whole game
+        self.shallow_depth = shallow_depth
+        self.max_depth = max_depth
+        self.depth_step = depth_step
+        self.swing_threshold = swing_threshold  # Centipawns between consecutive plies worth a closer look
+        self.decided_cp = decided_cp  # Beyond this the game is decided and deeper search changes nothing
+        self.concurrency = concurrency  # Plies deepened at once, e.g. the size of an engine pool
+        self.nodes = 0
+        self.searches = 0
+        self.deadline = None
+
+    def _remaining(self):
+        # None means unlimited; otherwise what is left of the tighter budget
+        time_left = nodes_left = None
+        if self.deadline is not None:
+            time_left = self.deadline - asyncio.get_running_loop().time()
+        if self.node_budget is not None:
+            nodes_left = self.node_budget - self.nodes
+        return time_left, nodes_left
+
+    def _exhausted(self):
+        time_left, nodes_left = self._remaining()
+        return (time_left is not None and time_left <= 0) or (nodes_left is not None and nodes_left <= 0)
+
+    async def _search(self, board, depth):
+        time_left, nodes_left = self._remaining()
+        # Never let one search overrun the budget; a cut-off search still returns its deepest result
+        limit = chess.engine.Limit(
+            depth=depth,
+            time=max(time_left, 0.01) if time_left is not None else None,
+            nodes=max(nodes_left, 1) if nodes_left is not None else None,
+        )
+        info = await self.analyse(board, limit)
+        self.searches += 1
+        if not info.get('cached'):
+            self.nodes += info.get('nodes') or 0
+        return info
+
+    def _value(self, info):
+        # White's view, clipped so swings between already decided positions do not count
+        cp = info['score'].white().score(mate_score=100000)
+        return max(-self.decided_cp, min(self.decided_cp, cp))
+
+    def _decided(self, info):
+        return abs(self._value(info)) >= self.decided_cp
+
+    def _candidates(self, infos, unstable, finished):
+        values = [self._value(info) for info in infos]
+        swings = [0] + [abs(values[i] - values[i - 1]) for i in range(1, len(values))]
+        candidates = []
+        for i, info in enumerate(infos):
+            if finished[i] or (info.get('depth') or 0) >= self.max_depth:
+                continue
+            # A swing implicates the positions on both sides of the move that caused it
+            swing = max(swings[i], swings[i + 1] if i + 1 < len(swings) else 0)
+            if swing >= self.swing_threshold or (unstable[i] and not self._decided(info)):
+                priority = swing + (self.swing_threshold if unstable[i] else 0)
+                candidates.append((-priority, info.get('depth') or 0, i))
+        return [i for _, _, i in sorted(candidates)]
+
+    async def run(self, boards):
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        if self.time_budget is not None:
+            self.deadline = started + self.time_budget
+
+        # Fast pass over every ply, then spend whatever is left where the eval is uncertain
+        infos = []
+        for start in range(0, len(boards), self.concurrency):
+            chunk = boards[start:start + self.concurrency]
+            infos.extend(await asyncio.gather(*(self._search(board, self.shallow_depth) for board in chunk)))
+        unstable = [False] * len(boards)
+        finished = [False] * len(boards)
+
+        async def deepen(i):
+            previous = infos[i]
+            depth = min((previous.get('depth') or 0) + self.depth_step, self.max_depth)
+            info = await self._search(boards[i], depth)
+            if (info.get('depth') or 0) <= (previous.get('depth') or 0):
+                # The budget cut the search short; this ply cannot get any deeper
+                finished[i] = True
+                return
+            # A best move that still changes with depth means the ply is not settled yet
+            unstable[i] = (previous.get('pv') or [None])[0] != (info.get('pv') or [None])[0]
+            infos[i] = info
+
+        while not self._exhausted():
+            candidates = self._candidates(infos, unstable, finished)
+            if not candidates:
+                # Every critical ply is settled: stop early rather than burn the rest of the budget
+                break
+            await asyncio.gather(*(deepen(i) for i in candidates[:self.concurrency]))
+
+        self.logger.debug(f"Adaptive review: {self.searches} searches, {self.nodes} nodes, "
+                          f"{loop.time() - started:.2f}s for {len(boards)} plies")
+        return infos
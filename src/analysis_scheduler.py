@@ -0,0 +1,76 @@
+import asyncio
+import logging
+
+
+class AnalysisScheduler:
+    def __init__(self, run_search, debounce=0.05, max_delay=0.25):
+        self.logger = logging.getLogger(__name__)
+        self.run_search = run_search  # Coroutine function searching one board until done or cancelled
+        self.debounce = debounce  # Quiet period before a new position is searched
+        self.max_delay = max_delay  # Upper bound on how long a stream of changes can postpone a search
+        self.target = None
+        self.changed = asyncio.Event()
+        self.search_key = None
+        self.search_task = None
+        self.loop_task = None
+        self.searches_started = 0
+
+    def start(self):
+        if self.loop_task is None:
+            self.loop_task = asyncio.create_task(self._run())
+
+    def request(self, board, force=False):
+        # Cheap and synchronous: callers only record the latest position, the loop owns the engine
+        self.target = board.copy()
+        if force:
+            # Search settings changed, so even the same position needs a new search
+            self.search_key = None
+        self.changed.set()
+
+    @staticmethod
+    def _key(board):
+        return board.fen()
+
+    async def _settle(self):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_delay
+        while True:
+            self.changed.clear()
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return
+            try:
+                await asyncio.wait_for(self.changed.wait(), min(self.debounce, remaining))
+            except asyncio.TimeoutError:
+                return
+
+    async def _run(self):
+        while True:
+            await self.changed.wait()
+            await self._settle()
+
+            board = self.target
+            key = self._key(board)
+            if key == self.search_key:
+                # Back on the position already being (or just) searched: keep that search
+                continue
+
+            await self._cancel_search()
+            self.search_key = key
+            self.searches_started += 1
+            self.search_task = asyncio.create_task(self.run_search(board))
+
+    async def _cancel_search(self):
+        if self.search_task is not None and not self.search_task.done():
+            # One cancel per search; python-chess turns it into a single UCI stop
+            self.search_task.cancel()
+            await asyncio.gather(self.search_task, return_exceptions=True)
+        self.search_task = None
+
+    async def stop(self):
+        if self.loop_task is not None:
+            self.loop_task.cancel()
+            await asyncio.gather(self.loop_task, return_exceptions=True)
+            self.loop_task = None
+        await self._cancel_search()
+        self.search_key = None
@@ -1,63 +1,122 @@
+import os
+import hmac
 import json
+import shlex
 import asyncio
 import logging
+import functools
+import metrics
 from game_board import GameBoard
-from quart import Quart, websocket, request, jsonify, render_template
+from eco_index import get_eco_index
+from polyglot_book import get_polyglot_book
+from engine_pool import EnginePool
+from sessions import SessionManager, SessionLimitError
+from tracing import get_tracer, get_profiler
+from quart import Quart, Response, websocket, request, jsonify, render_template, g
 from quart_cors import cors
 
+logger = logging.getLogger(__name__)
+
 app = Quart(__name__)
 cors(app, allow_origin="http://localhost:3000")
-active_websockets = set()
-
-async def game_tree_callback(new_tree):
-    for ws in active_websockets:
-        try:
-            # print(new_tree)
-            await ws.send(json.dumps({'game_tree': new_tree}))
-        except Exception as e:
-            # Handle exceptions, e.g., closed connections
-            pass
-
-async def eval_callback(value):
-    for ws in active_websockets:
-        try:
-            # Parsing the score
-            score = value.get('score')
-            if score:
-                # Handling 'Mate' scores
-                if "Mate" in score:
-                    mate_value = score.split('(')[1].split(')')[0]
-                    parsed_score = mate_value
-                    # if mate_value.lstrip("-").isdigit():
-                    #     mate_in = int(mate_value)
-                    # parsed_score = f"Mate in {mate_in}" if mate_in > 0 else f"Mated in {abs(mate_in)}"
-                # Handling 'Cp' scores
-                elif "Cp" in score:
-                    is_negative = '-' in score  # Check if score is negative
-                    cp_value = score.split('+')[1].split(')')[0] if '+' in score else score.split('-')[1].split(')')[0]
-                    if cp_value.isdigit():
-                        cp_score = int(cp_value)
-                        if is_negative:  # Keep the score negative if originally negative
-                            cp_score *= -1
-                        if "BLACK" in score:
-                            cp_score *= -1  # Invert score for BLACK
-                        parsed_score = cp_score / 100
-                    else:
-                        parsed_score = None
-
-                await ws.send(json.dumps({'value': parsed_score}))
-            else:
-                logging.error("No score found in evaluation value")
-        except Exception as e:
-            logging.error(f"Error sending evaluation value: {e}")
-
-games = {}
+
+tree_callback_seconds = metrics.callback_seconds.labels('game_tree_callback')
+eval_callback_seconds = metrics.callback_seconds.labels('eval_callback')
+
+async def game_tree_callback(session, event):
+    with tree_callback_seconds.time():
+        # Snapshots replace the client's tree, everything else is an incremental patch
+        key = 'game_tree' if event['type'] == 'snapshot' else 'game_tree_patch'
+        session.clients.broadcast({key: event})
+
+async def eval_callback(session, value):
+    with eval_callback_seconds.time():
+        send_eval(session, value)
+
+def send_eval(session, value):
+    if value.get('book'):
+        # Book position: no engine eval, the client shows the book moves instead
+        session.clients.broadcast_eval({'book_moves': value['moves']})
+        return
+
+    # Scores arrive structured and from White's point of view; 'value' keeps the eval bar's format
+    if value['multipv'] == 1:
+        value['value'] = value['cp'] / 100 if value['cp'] is not None else f"M{value['mate']}"
+    # Queued per client with only the newest eval per line kept, so a slow socket never blocks the engine loop
+    session.clients.broadcast_eval(value, key=value['multipv'])
+
+# One engine pool for every session instead of a Stockfish process per board.
+# SHIRO_ENGINE swaps in another engine command, e.g. the fake engine for load tests
+engine_command = shlex.split(os.environ['SHIRO_ENGINE']) if 'SHIRO_ENGINE' in os.environ else "engines/stockfish"
+engine_pool = EnginePool(engine_command, size=os.cpu_count())
+
+def create_board(session):
+    return GameBoard(callback=functools.partial(game_tree_callback, session),
+                     eval_callback=functools.partial(eval_callback, session),
+                     engine_pool=engine_pool)
+
+sessions = SessionManager(create_board, max_sessions=200, idle_timeout=900)
+
+def client_queue_depths():
+    return [client.queue_depth() for session in sessions.sessions.values() for client in session.clients]
+
+# Read from the live objects only when scraped
+metrics.registry.gauge('shiro_live_sessions', "Sessions with a board in memory", lambda: len(sessions))
+metrics.registry.gauge('shiro_ws_clients', "Connected websocket clients", lambda: len(client_queue_depths()))
+metrics.registry.gauge('shiro_ws_send_queue_depth', "Messages waiting in all websocket send queues",
+                       lambda: sum(client_queue_depths()))
+metrics.registry.gauge('shiro_ws_send_queue_depth_max', "Longest websocket send queue",
+                       lambda: max(client_queue_depths(), default=0))
+
+warm_up_task = None
+
+async def warm_up():
+    # One engine handshake and the opening data, loaded while the server already takes requests.
+    # The other engines are spawned by the pool when jobs queue up
+    try:
+        await asyncio.gather(engine_pool.start(engines=1), asyncio.to_thread(get_eco_index),
+                             asyncio.to_thread(get_polyglot_book))
+    except Exception as e:
+        # Engine work retries the spawn on first use; /ready reports not ready until one succeeds
+        logger.error(f"Error warming up: {e}")
 
 @app.before_serving
 async def initialize_games():
-    games["default"] = GameBoard(engine_name="stockfish", callback=game_tree_callback, eval_callback=eval_callback)
-    await asyncio.sleep(2)
-    await games["default"].start_background_analysis(depth=20)
+    global warm_up_task
+    warm_up_task = asyncio.create_task(warm_up())
+    sessions.start_eviction()
+
+@app.after_serving
+async def shutdown_games():
+    if warm_up_task is not None:
+        warm_up_task.cancel()
+    await sessions.close_all()
+    await engine_pool.close()
+
+async def get_session(args):
+    return await sessions.get(args.get('session', 'default'))
+
+# Admin routes only answer local requests; '<local>' is the test client
+ADMIN_ADDRESSES = {'127.0.0.1', '::1', '<local>'}
+# Admin routes stay off unless a token is configured; requests then send "Authorization: Bearer <token>"
+ADMIN_TOKEN = os.environ.get('SHIRO_ADMIN_TOKEN')
+MAX_PROFILE_SECONDS = 120
+
+@app.before_request
+async def start_request_span():
+    g.span = get_tracer().start(f"{request.method} {request.path}", session=request.args.get('session', 'default'))
+
+@app.after_request
+async def finish_request_span(response):
+    span = g.pop('span', None)
+    if span is not None:
+        span.attributes['status'] = response.status_code
+        span.finish()
+    return response
+
+@app.errorhandler(SessionLimitError)
+async def session_limit(error):
+    return jsonify({'error': str(error)}), 503
 
 @app.route('/')
 async def index():
@@ -65,46 +124,138 @@ async def index():
 
 @app.websocket('/ws')
 async def ws():
-    game_id = 'default'  # Using a fixed game ID for simplification
-    game = games[game_id]
+    try:
+        session = await get_session(websocket.args)
+    except SessionLimitError as e:
+        await websocket.close(1013, str(e))
+        return
+    game = session.board
+
+    def current_state():
+        return [json.dumps({'fen': game.get_current_fen()}), json.dumps({'game_tree': game.get_tree_snapshot()})]
 
+    # Everything for this client goes through its own queue and writer task, replies included,
+    # so they stay ordered with broadcasts and a slow client only delays itself
     ws = websocket._get_current_object()
-    active_websockets.add(ws)
+    client = await session.attach(ws, resync=current_state)
 
     # Send the current board state immediately upon WebSocket connection
-    await websocket.send(json.dumps({'fen': game.get_current_fen()}))
+    for message in current_state():
+        client.send(message)
 
+    tracer = get_tracer()
     try:
         while True:
             data = await websocket.receive()
             move_data = json.loads(data)
-            
-            if 'navigate_forward' in move_data:
-                move = game.navigate_forward()
-                await websocket.send(json.dumps({'fen': game.get_current_fen()}))
-            elif 'navigate_backward' in move_data:
-                move = game.navigate_backward()
-                await websocket.send(json.dumps({'fen': game.get_current_fen()}))
-            else:
-                is_legal = game.make_move_with_variation(move_data.get('move'))
-                if is_legal:
-                    await websocket.send(json.dumps({'fen': game.get_current_fen()}))
-                else:
-                    await websocket.send(json.dumps({'error': 'Illegal move'}))
+            session.touch()
+            # One span per command, named after its first key ('move', 'navigate_forward', ...)
+            with tracer.span(f"ws {next(iter(move_data), 'empty')}", session=session.id):
+                await handle_command(session, client, move_data)
     finally:
-        active_websockets.remove(ws)
+        await session.detach(ws)
+
+async def handle_command(session, client, move_data):
+    game = session.board
+    if 'tree_snapshot' in move_data:
+        # Client missed a patch (sequence gap) and asks for a full resync
+        client.send(json.dumps({'game_tree': game.get_tree_snapshot()}))
+    elif 'navigate_forward' in move_data:
+        game.navigate_forward()
+        client.send(json.dumps({'fen': game.get_current_fen()}))
+    elif 'navigate_backward' in move_data:
+        game.navigate_backward()
+        client.send(json.dumps({'fen': game.get_current_fen()}))
+    elif 'multipv' in move_data:
+        game.set_multipv(move_data['multipv'])
+    elif 'expand_line' in move_data:
+        if game.expand_line(move_data['expand_line']) is None:
+            client.send(json.dumps({'error': 'No such engine line'}))
+    elif 'tree_analysis' in move_data:
+        if move_data['tree_analysis']:
+            game.start_tree_analysis()
+        else:
+            await game.stop_tree_analysis()
+    elif 'position_search' in move_data:
+        result = await game.search_position(limit=move_data.get('limit', 20))
+        client.send(json.dumps({'position_search': result}))
+    elif 'explore' in move_data:
+        client.send(json.dumps({'explore': await game.explore()}))
+    elif 'navigate_to' in move_data:
+        if game.navigate_to_node(move_data['navigate_to']) is not None:
+            client.send(json.dumps({'fen': game.get_current_fen()}))
+        else:
+            client.send(json.dumps({'error': 'Unknown node'}))
+    else:
+        is_legal = game.make_move_with_variation(move_data.get('move'))
+        if is_legal:
+            client.send(json.dumps({'fen': game.get_current_fen()}))
+        else:
+            client.send(json.dumps({'error': 'Illegal move'}))
+
+@app.route('/ready')
+async def ready():
+    # Serving starts before the engine handshake; engine-backed features work once this returns 200
+    status = {'ready': engine_pool.ready, 'engine': engine_pool.engine_name, 'engines': engine_pool.spawned,
+              'sessions': len(sessions)}
+    return jsonify(status), 200 if engine_pool.ready else 503
+
+def local_only(handler):
+    # For routes any local tool may read but nothing outside the machine should, e.g. a Prometheus scraper
+    @functools.wraps(handler)
+    async def wrapper(*args, **kwargs):
+        if request.remote_addr not in ADMIN_ADDRESSES:
+            return jsonify({'error': 'This route is only served locally'}), 403
+        return await handler(*args, **kwargs)
+    return wrapper
+
+@app.route('/metrics')
+@local_only
+async def prometheus_metrics():
+    return Response(metrics.registry.render(), content_type=metrics.CONTENT_TYPE)
+
+def admin_only(handler):
+    @functools.wraps(handler)
+    async def wrapper(*args, **kwargs):
+        if not ADMIN_TOKEN:
+            return jsonify({'error': 'Admin routes are disabled; set SHIRO_ADMIN_TOKEN to enable them'}), 404
+        # A proxy in front of the app makes every request look local, so the address alone is not enough
+        if request.remote_addr not in ADMIN_ADDRESSES:
+            return jsonify({'error': 'Admin routes are only served locally'}), 403
+        if not hmac.compare_digest(request.headers.get('Authorization', '').encode(), f"Bearer {ADMIN_TOKEN}".encode()):
+            return jsonify({'error': 'Missing or wrong admin token'}), 401
+        return await handler(*args, **kwargs)
+    return wrapper
+
+@app.route('/admin/slow_ops')
+@admin_only
+async def slow_ops():
+    # Most recent first, each with the time its nested GameBoard calls took
+    tracer = get_tracer()
+    operations = tracer.slow_operations(min_ms=request.args.get('min_ms', 0, type=float),
+                                        limit=request.args.get('limit', None, type=int))
+    return jsonify({'threshold_ms': tracer.slow_threshold * 1000, 'operations': operations}), 200
+
+@app.route('/admin/profile', methods=['GET', 'POST'])
+@admin_only
+async def profile():
+    profiler = get_profiler()
+    if request.method == 'GET':
+        return jsonify(profiler.status()), 200
+    seconds = min(request.args.get('seconds', 10, type=float), MAX_PROFILE_SECONDS)
+    output = profiler.start(seconds)
+    if output is None:
+        return jsonify({'error': 'A profile is already being captured', **profiler.status()}), 409
+    return jsonify({'seconds': seconds, 'output': output}), 202
 
 @app.route('/current_fen')
 async def current_fen():
-    game_id = 'default'  # Simplified to use a single game instance
-    game_board = games.get(game_id)
-    return jsonify({'fen': game_board.get_current_fen() if game_board else 'Game not found'}), \
-           (200 if game_board else 404)
+    game_board = (await get_session(request.args)).board
+    return jsonify({'fen': game_board.get_current_fen()}), 200
 
 @app.route('/pgn', methods=['POST'])
 async def pgn_to_game():
-    game_id = 'default'
-    game = games[game_id]
+    game = (await get_session(request.args)).board
 
     pgn_data = await request.get_json()
     pgn = pgn_data.get('pgn')
@@ -114,22 +265,30 @@ async def pgn_to_game():
 
 @app.route('/navigate_forward', methods=['POST'])
 async def navigate_forward():
-    game_id = 'default'
-    game = games[game_id]
+    game = (await get_session(request.args)).board
     move = game.navigate_forward()
     return jsonify({'fen': game.get_current_fen(), 'move': move}), 200 if move else 400
 
 @app.route('/navigate_backward', methods=['POST'])
 async def navigate_backward():
-    game_id = 'default'
-    game = games[game_id]
+    game = (await get_session(request.args)).board
     move = game.navigate_backward()
     return jsonify({'fen': game.get_current_fen(), 'move': move}), 200 if move else 400
 
+@app.route('/position_search')
+async def position_search():
+    game = (await get_session(request.args)).board
+    result = await game.search_position(limit=request.args.get('limit', 20, type=int))
+    return jsonify(result), 200
+
+@app.route('/explore')
+async def explore():
+    game = (await get_session(request.args)).board
+    return jsonify(await game.explore(top_games=request.args.get('top_games', 8, type=int))), 200
+
 @app.route('/reset', methods=['POST'])
 async def reset():
-    game_id = 'default'
-    game = games[game_id]
+    game = (await get_session(request.args)).board
     game.reset_board()
     return jsonify({'fen': game.get_current_fen()}), 200
 
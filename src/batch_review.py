@@ -0,0 +1,228 @@
+import os
+import json
+import asyncio
+import logging
+import argparse
+import chess
+import chess.engine
+import chess.pgn
+from engine_pool import EnginePool
+from eval_cache import EvalCache
+from polyglot_book import get_polyglot_book
+from evaluation import score_payload
+
+logger = logging.getLogger(__name__)
+
+READ_CHUNK = 1 << 20  # Bytes read at a time when scanning the output file
+HEADER_KEYS = ('Event', 'Site', 'Date', 'Round', 'White', 'Black', 'Result', 'WhiteElo', 'BlackElo', 'ECO')
+
+
+def iter_games(paths, skip=0):
+    # Reads one game at a time so memory does not depend on the size of the PGN files
+    index = 0
+    for path in paths:
+        with open(path, 'r', encoding='utf-8', errors='replace') as pgn_file:
+            while True:
+                if index < skip:
+                    # Already reviewed in a previous run: skip without building the game tree
+                    if not chess.pgn.skip_game(pgn_file):
+                        break
+                    index += 1
+                    continue
+                game = chess.pgn.read_game(pgn_file)
+                if game is None:
+                    break
+                yield index, game
+                index += 1
+
+
+def count_completed(output_path):
+    # Results are written in game order, so the number of complete lines is the resume point
+    if not os.path.exists(output_path):
+        return 0
+    # Read in fixed-size chunks, so resuming takes constant memory however large the output is
+    with open(output_path, 'rb+') as output_file:
+        end = output_file.seek(0, os.SEEK_END)
+        complete = 0
+        position = end
+        while position > 0:
+            start = max(0, position - READ_CHUNK)
+            output_file.seek(start)
+            newline = output_file.read(position - start).rfind(b'\n')
+            if newline != -1:
+                complete = start + newline + 1
+                break
+            position = start
+        if complete < end:
+            # A crash mid-write left a partial record behind
+            output_file.truncate(complete)
+
+        output_file.seek(0)
+        lines = 0
+        while chunk := output_file.read(READ_CHUNK):
+            lines += chunk.count(b'\n')
+    return lines
+
+
+class BatchReviewer:
+    def __init__(self, pool, output_path, depth=18, eval_cache=None, workers=None, window=None,
+                 book_directory='book/polyglot-collection'):
+        self.pool = pool
+        self.output_path = output_path
+        self.limit = chess.engine.Limit(depth=depth)
+        self.eval_cache = eval_cache or EvalCache()
+        self.workers = workers or pool.size
+        # Games read but not yet written; bounds queue plus reorder buffer regardless of input size
+        self.window = asyncio.Semaphore(window or self.workers * 4)
+        self.queue = asyncio.Queue(maxsize=self.workers * 2)
+        self.results = {}  # Finished games waiting for their turn to be written
+        self.results_ready = asyncio.Event()
+        self.in_flight = {}  # Zobrist key -> future, so concurrent games share one search per position
+        self.book = get_polyglot_book(book_directory)
+        self.reviewed = 0
+
+    async def _analyse(self, board):
+        engine_key = self.pool.engine_key
+        cached = self.eval_cache.get(board, engine_key)
+        if cached is not None and cached['depth'] >= self.limit.depth:
+            return cached
+
+        key = EvalCache.position_key(board)
+        future = self.in_flight.get(key)
+        if future is not None:
+            return await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        self.in_flight[key] = future
+        try:
+            info = await self.pool.analyse(board, self.limit)
+            self.eval_cache.put(board, engine_key, info)
+            future.set_result(info)
+            return info
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # Marks it retrieved when no other game was waiting on it
+            raise
+        finally:
+            if not future.done():
+                # Cancelled: games waiting on this search must not wait forever
+                future.cancel()
+            del self.in_flight[key]
+
+    async def review_game(self, index, game):
+        record = {
+            'index': index,
+            'headers': {key: game.headers[key] for key in HEADER_KEYS if key in game.headers},
+            'moves': [],
+            'evals': [],
+        }
+        jobs = []
+        board = game.board()
+        in_book = True
+        entry = board.copy()  # Last book position, or the start: the baseline for the first move out of book
+
+        for move in game.mainline_moves():
+            board.push(move)
+            record['moves'].append(move.uci())
+            in_book = in_book and self.book.contains(board)
+            if in_book:
+                entry = board.copy()
+            jobs.append(None if in_book else self._analyse(board.copy()))
+
+        analysed = [job for job in jobs if job is not None]
+        if analysed:
+            analysed.insert(0, self._analyse(entry))
+        infos = iter(await asyncio.gather(*analysed, return_exceptions=True))
+        entry_info = next(infos, None)
+        for job in jobs:
+            if job is None:
+                record['evals'].append({'book': True})
+                continue
+            info = next(infos)
+            if isinstance(info, Exception):
+                record['evals'].append({'error': str(info) or type(info).__name__})
+            else:
+                record['evals'].append({**score_payload(info['score']), 'depth': info.get('depth')})
+            if entry_info is not None:
+                # The first move out of book is judged against the position it was played from
+                if not isinstance(entry_info, Exception):
+                    record['evals'][-1]['before'] = score_payload(entry_info['score'])
+                entry_info = None
+        return record
+
+    async def _read(self, paths, skip):
+        for index, game in iter_games(paths, skip):
+            await self.window.acquire()
+            await self.queue.put((index, game))
+        for _ in range(self.workers):
+            await self.queue.put(None)
+
+    async def _work(self):
+        while True:
+            item = await self.queue.get()
+            if item is None:
+                return
+            index, game = item
+            try:
+                record = await self.review_game(index, game)
+            except Exception as e:
+                logger.error(f"Error reviewing game {index}: {e}")
+                record = {'index': index, 'error': str(e)}
+            self.results[index] = record
+            self.results_ready.set()
+
+    async def _write(self, next_index, output_file, done):
+        while not (done.is_set() and not self.results):
+            await self.results_ready.wait()
+            self.results_ready.clear()
+            while next_index in self.results:
+                output_file.write(json.dumps(self.results.pop(next_index)) + '\n')
+                output_file.flush()
+                self.window.release()
+                self.reviewed += 1
+                next_index += 1
+            self.eval_cache.flush()
+
+    async def run(self, paths):
+        skip = count_completed(self.output_path)
+        if skip:
+            logger.info(f"Resuming after {skip} reviewed games")
+
+        done = asyncio.Event()
+        with open(self.output_path, 'a') as output_file:
+            writer = asyncio.create_task(self._write(skip, output_file, done))
+            await asyncio.gather(self._read(paths, skip), *(self._work() for _ in range(self.workers)))
+            done.set()
+            self.results_ready.set()
+            await writer
+        self.eval_cache.flush()
+        return self.reviewed
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Review every game of one or more PGN files")
+    parser.add_argument('pgn', nargs='+')
+    parser.add_argument('--output', default='review.jsonl')
+    parser.add_argument('--engine', default='stockfish')
+    parser.add_argument('--engines', type=int, default=None, help="engine processes (default: one per core)")
+    parser.add_argument('--depth', type=int, default=18)
+    parser.add_argument('--hash', type=int, default=64, help="hash size per engine in MB")
+    parser.add_argument('--cache', default='evals.sqlite', help="on-disk eval cache shared across runs")
+    parser.add_argument('--timeout', type=float, default=None, help="per-position timeout in seconds")
+    args = parser.parse_args()
+
+    pool = await EnginePool(f"engines/{args.engine}", size=args.engines, hash_mb=args.hash,
+                            timeout=args.timeout).start()
+    eval_cache = EvalCache(db_path=args.cache)
+    try:
+        reviewer = BatchReviewer(pool, args.output, depth=args.depth, eval_cache=eval_cache)
+        reviewed = await reviewer.run(args.pgn)
+        logger.info(f"Reviewed {reviewed} games into {args.output}")
+    finally:
+        eval_cache.close()
+        await pool.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main())
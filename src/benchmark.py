@@ -0,0 +1,201 @@
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import logging
+import platform
+import argparse
+import statistics
+import subprocess
+import chess
+import chess.pgn
+from game_board import GameBoard, OpeningNode
+from eval_cache import EvalCache
+
+logger = logging.getLogger(__name__)
+
+FAKE_ENGINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'engines', 'fake_uci.py')
+TREE_SIZES = (100, 1000, 10000, 100000)
+
+
+def fake_engine_command():
+    # A list, so the fake engine runs without relying on its executable bit or shebang
+    return [sys.executable, FAKE_ENGINE]
+
+
+def synthetic_game(size, seed=0, line_length=24):
+    # Deterministic tree of `size` nodes: random lines that branch off earlier ones
+    rng = random.Random(seed)
+    game = chess.pgn.Game()
+    nodes = 0
+    while nodes < size:
+        node = game
+        board = game.board()
+        # Follow an existing line for a while, then branch off with new moves
+        while node.variations and rng.random() < 0.85:
+            node = rng.choice(node.variations)
+            board.push(node.move)
+        for _ in range(line_length):
+            if nodes >= size:
+                break
+            moves = list(board.legal_moves)
+            if not moves:
+                break
+            move = rng.choice(moves)
+            if node.has_variation(move):
+                node = node.variation(move)
+            else:
+                node = node.add_variation(move)
+                nodes += 1
+            board.push(move)
+    return game
+
+
+def measure(function, repeat=5, number=1):
+    # Seconds per call for each run, like timeit.repeat
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for _ in range(number):
+            function()
+        timings.append((time.perf_counter() - started) / number)
+    return timings
+
+
+async def measure_async(function, repeat=5, number=1):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for _ in range(number):
+            await function()
+        timings.append((time.perf_counter() - started) / number)
+    return timings
+
+
+def summarize(name, timings, **extra):
+    return {
+        'name': name,
+        'runs': len(timings),
+        'min_s': min(timings),
+        'median_s': statistics.median(timings),
+        'mean_s': statistics.mean(timings),
+        **extra,
+    }
+
+
+def quiet_board():
+    # No engine, callbacks or background tasks: only the code under test runs
+    return GameBoard(eval_cache=EvalCache())
+
+
+def bench_eco(repeat):
+    yield summarize('opening_node.load_eco_book', measure(lambda: OpeningNode().load_eco_book(), repeat))
+
+
+def bench_tree(size, repeat):
+    game = synthetic_game(size)
+    pgn = str(game)
+    board = quiet_board()
+
+    yield summarize(f'pgn_to_game[{size}]', measure(lambda: board.pgn_to_game(pgn), repeat), nodes=size)
+    # Every parse builds new nodes, so pick the target node from the tree that stays loaded
+    deepest = max(board.tree_model.nodes.values(), key=lambda node: node.ply())
+    yield summarize(f'list_variations[{size}]', measure(board.list_variations, repeat), nodes=size)
+    yield summarize(f'get_tree_snapshot_json[{size}]',
+                    measure(lambda: json.dumps(board.get_tree_snapshot()), repeat), nodes=size)
+
+    def get_opening_cold():
+        board.node_openings = None
+        board.get_opening(deepest)
+
+    yield summarize(f'get_opening_cold[{size}]', measure(get_opening_cold, repeat), nodes=size)
+    yield summarize(f'get_opening_warm[{size}]', measure(lambda: board.get_opening(deepest), repeat, 1000), nodes=size)
+    yield summarize(f'_get_current_node[{size}]', measure(board._get_current_node, repeat, 10000), nodes=size)
+
+    def edit_cycle():
+        # One variation added and removed at the cursor, the way the GUI edits a large tree
+        move = next(iter(board.board.legal_moves))
+        board.make_move_with_variation(move.uci())
+        board._remove_variation(board._get_current_node())
+
+    yield summarize(f'add_remove_variation[{size}]', measure(edit_cycle, repeat, 100), nodes=size)
+
+
+async def bench_review(repeat):
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarks', 'games.pgn')) as pgn_file:
+        game = chess.pgn.read_game(pgn_file)
+    plies = len(list(game.mainline_moves()))
+
+    board = quiet_board()
+    board.engine_path = fake_engine_command()
+    await board.init_engine()
+    try:
+        async def review():
+            board.eval_cache = EvalCache()  # Cold cache, so every ply reaches the engine
+            await board.game_review(game)
+
+        timings = await measure_async(review, repeat)
+        yield summarize('game_review[fake_engine]', timings, plies=plies,
+                        plies_per_s=plies / statistics.median(timings))
+    finally:
+        await board.close_engine()
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(baseline_path, results):
+    with open(baseline_path) as baseline_file:
+        baseline = {result['name']: result for result in json.load(baseline_file)['results']}
+    for result in results:
+        before = baseline.get(result['name'])
+        if before is None:
+            continue
+        ratio = result['median_s'] / before['median_s'] if before['median_s'] else float('inf')
+        flag = '  SLOWER' if ratio > 1.1 else '  faster' if ratio < 0.9 else ''
+        print(f"{result['name']:<40} {before['median_s'] * 1000:10.3f}ms -> {result['median_s'] * 1000:10.3f}ms "
+              f"({ratio:.2f}x){flag}", file=sys.stderr)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Time GameBoard hot paths; results are written as JSON")
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(TREE_SIZES), help="synthetic tree sizes")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', default=None, help="write results to this JSON file (default: stdout)")
+    parser.add_argument('--compare', default=None, help="earlier results file to compare against")
+    args = parser.parse_args()
+
+    results = list(bench_eco(args.repeat))
+    for size in args.sizes:
+        logger.info(f"Benchmarking a {size}-node tree")
+        results.extend(bench_tree(size, args.repeat))
+    results.extend([result async for result in bench_review(args.repeat)])
+
+    report = {
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'chess': chess.__version__,
+        'machine': platform.machine(),
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(report, output_file, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    if args.compare:
+        compare(args.compare, results)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main())
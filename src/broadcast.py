@@ -0,0 +1,95 @@
+import json
+import asyncio
+import logging
+from collections import deque
+
+
+class ClientConnection:
+    def __init__(self, ws, resync=None, max_queue=256):
+        self.logger = logging.getLogger(__name__)
+        self.ws = ws
+        self.resync = resync  # Returns the messages that rebuild the client's state after an overflow
+        self.max_queue = max_queue
+        self.queue = deque()  # Ordered messages (tree patches, replies) that must not be dropped
+        self.latest_evals = {}  # Only the newest eval per key (e.g. MultiPV line) matters, older ones are replaced
+        self.needs_resync = False
+        self.wakeup = asyncio.Event()
+        self.writer_task = asyncio.create_task(self._write())
+
+    def send(self, message):
+        if len(self.queue) >= self.max_queue:
+            # The client fell too far behind: drop the backlog and send it a fresh snapshot instead
+            self.queue.clear()
+            self.needs_resync = True
+        else:
+            self.queue.append(message)
+        self.wakeup.set()
+
+    def send_eval(self, message, key=None):
+        self.latest_evals.pop(key, None)  # Re-inserted last, so lines go out in update order
+        self.latest_evals[key] = message
+        self.wakeup.set()
+
+    def queue_depth(self):
+        return len(self.queue) + len(self.latest_evals)
+
+    async def _write(self):
+        try:
+            while True:
+                await self.wakeup.wait()
+                self.wakeup.clear()
+                while self.queue or self.needs_resync or self.latest_evals:
+                    if self.needs_resync:
+                        self.needs_resync = False
+                        self.queue.extendleft(reversed(self.resync() if self.resync else []))
+                    if self.queue:
+                        await self.ws.send(self.queue.popleft())
+                    elif self.latest_evals:
+                        key = next(iter(self.latest_evals))
+                        await self.ws.send(self.latest_evals.pop(key))
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            # Closed connection; the websocket handler removes the client
+            self.logger.debug(f"Stopped writing to client: {e}")
+
+    def close(self):
+        self.writer_task.cancel()
+
+
+class Broadcaster:
+    def __init__(self, max_queue=256):
+        self.clients = {}  # Maps websocket to its ClientConnection
+        self.max_queue = max_queue
+
+    def __len__(self):
+        return len(self.clients)
+
+    def __iter__(self):
+        return iter(self.clients.values())
+
+    def add(self, ws, resync=None):
+        client = ClientConnection(ws, resync=resync, max_queue=self.max_queue)
+        self.clients[ws] = client
+        return client
+
+    def discard(self, ws):
+        client = self.clients.pop(ws, None)
+        if client is not None:
+            client.close()
+
+    def broadcast(self, payload):
+        # Serialized once, however many clients are listening
+        message = json.dumps(payload)
+        for client in self.clients.values():
+            client.send(message)
+
+    def broadcast_eval(self, payload, key=None):
+        message = json.dumps(payload)
+        for client in self.clients.values():
+            client.send_eval(message, key)
+
+    def close(self):
+        for client in self.clients.values():
+            client.close()
+        self.clients.clear()
@@ -0,0 +1,222 @@
+import os
+import mmap
+import array
+import bisect
+import struct
+import logging
+import threading
+import chess
+import chess.polyglot
+
+logger = logging.getLogger(__name__)
+
+INDEX_MAGIC = b'SHIROECO'
+INDEX_VERSION = 2
+# magic, version, entry count, source mtime (ns), source size, max ply, string table size
+HEADER = struct.Struct('=8sIIqqII')
+
+
+def iter_eco_openings(eco_book):
+    # Entries may wrap over several lines; an entry is complete once its move list hits '*'
+    current_opening_lines = ''
+
+    for line in eco_book.splitlines():
+        if line.startswith(tuple("ABCDE")) and '*' in current_opening_lines:
+            yield parse_opening_line(current_opening_lines)
+            current_opening_lines = line
+        else:
+            current_opening_lines += ' ' + line
+
+    if current_opening_lines.strip():
+        yield parse_opening_line(current_opening_lines)
+
+
+def parse_opening_line(line):
+    parts = line.split('"')
+    code = parts[0].strip()
+    name = parts[1].strip()
+    moves = parts[2].split('*')[0].strip()
+    return code, name, moves
+
+
+def replay_eco_moves(moves):
+    # Book lines are move-numbered SAN ("1.e4 e5 2.Nf3"); yields the board after each move
+    board = chess.Board()
+    for token in moves.split():
+        san = token.split('.')[-1]
+        if san:  # Tolerates a detached number like "12. Nd4"
+            board.push_san(san)
+            yield board
+
+
+class EcoIndex:
+    def __init__(self, keys, values, strings, max_ply, strings_start=0):
+        self.keys = keys  # Sorted uint64 Zobrist keys of the named positions
+        self.values = values  # uint32 offsets into the string table, parallel to keys
+        self.strings = strings  # bytes, or the whole mapped file with the table at strings_start
+        self.strings_start = strings_start
+        self.max_ply = max_ply
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _entry(self, offset):
+        start = self.strings_start + offset
+        end = self.strings.find(b'\n', start)
+        code, name = self.strings[start:end].decode('utf-8').split('\t', 1)
+        return code, name
+
+    def lookup(self, key):
+        i = bisect.bisect_left(self.keys, key)
+        openings = []
+        while i < len(self.keys) and self.keys[i] == key:
+            openings.append(self._entry(self.values[i]))
+            i += 1
+        return openings
+
+    def classify(self, board):
+        return self.lookup(chess.polyglot.zobrist_hash(board))
+
+    def find_opening(self, board, moves):
+        # Deepest named position along the line; positions are keyed by hash, so transpositions match too
+        last_opening = None
+        for ply, move in enumerate(moves, 1):
+            if ply > self.max_ply:
+                break
+            board.push(move)
+            openings = self.classify(board)
+            if openings:
+                last_opening = openings
+        return last_opening
+
+    def classify_tree(self, game):
+        # One pass over every node: each node gets the deepest opening named on its path
+        board = game.board()
+        openings = {game: None}
+        stack = [(game, iter(game.variations))]
+
+        while stack:
+            node, children = stack[-1]
+            child = next(children, None)
+            if child is None:
+                stack.pop()
+                if stack:
+                    board.pop()
+                continue
+
+            board.push(child.move)
+            named = self.classify(board) if len(stack) <= self.max_ply else None
+            openings[child] = named or openings[node]
+            stack.append((child, iter(child.variations)))
+
+        return openings
+
+    @staticmethod
+    def compile(eco_book):
+        entries = []
+        strings = bytearray()
+        max_ply = 0
+
+        for code, name, moves in iter_eco_openings(eco_book):
+            if not moves:
+                continue
+            try:
+                for board in replay_eco_moves(moves):
+                    pass
+            except ValueError as e:
+                logger.warning(f"Skipping ECO line {code} {name}: {e}")
+                continue
+            entries.append((chess.polyglot.zobrist_hash(board), len(strings)))
+            strings += f"{code}\t{name}\n".encode('utf-8')
+            max_ply = max(max_ply, len(board.move_stack))
+
+        # Stable sort keeps openings that share a line in book order
+        entries.sort(key=lambda entry: entry[0])
+        keys = array.array('Q', (key for key, _ in entries))
+        values = array.array('I', (offset for _, offset in entries))
+        return keys, values, bytes(strings), max_ply
+
+    @classmethod
+    def build(cls, file_path):
+        with open(file_path, 'r') as eco_file:
+            keys, values, strings, max_ply = cls.compile(eco_file.read())
+        return cls(keys, values, strings, max_ply)
+
+    @classmethod
+    def write(cls, file_path, index_path):
+        stat = os.stat(file_path)
+        with open(file_path, 'r') as eco_file:
+            keys, values, strings, max_ply = cls.compile(eco_file.read())
+
+        header = HEADER.pack(INDEX_MAGIC, INDEX_VERSION, len(keys), stat.st_mtime_ns, stat.st_size,
+                             max_ply, len(strings))
+        tmp_path = f"{index_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as index_file:
+            index_file.write(header)
+            index_file.write(keys.tobytes())
+            index_file.write(values.tobytes())
+            index_file.write(strings)
+        os.replace(tmp_path, index_path)
+
+    @classmethod
+    def open(cls, file_path, index_path):
+        stat = os.stat(file_path)
+        with open(index_path, 'rb') as index_file:
+            buffer = mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, count, mtime_ns, size, max_ply, _ = HEADER.unpack_from(buffer)
+        if (magic, version, mtime_ns, size) != (INDEX_MAGIC, INDEX_VERSION, stat.st_mtime_ns, stat.st_size):
+            buffer.close()
+            return None
+
+        view = memoryview(buffer)
+        keys_start = HEADER.size
+        values_start = keys_start + 8 * count
+        strings_start = values_start + 4 * count
+        keys = view[keys_start:values_start].cast('Q')
+        values = view[values_start:strings_start].cast('I')
+        return cls(keys, values, buffer, max_ply, strings_start)
+
+    @classmethod
+    def load(cls, file_path='book/scid.eco', index_path=None):
+        index_path = index_path or f"{file_path}.idx"
+        try:
+            index = cls.open(file_path, index_path)
+            if index is not None:
+                return index
+        except (OSError, ValueError, struct.error):
+            pass
+
+        # Missing or stale compiled index: rebuild it next to the book
+        try:
+            cls.write(file_path, index_path)
+            return cls.open(file_path, index_path)
+        except FileNotFoundError:
+            logger.error(f"ECO book file not found at {file_path}")
+            raise
+        except OSError as e:
+            logger.warning(f"Could not write compiled ECO index to {index_path}, using in-memory index: {e}")
+            return cls.build(file_path)
+
+
+_shared_indexes = {}
+_shared_lock = threading.Lock()
+
+
+def get_eco_index(file_path='book/scid.eco'):
+    # One index per book per process, shared by every GameBoard
+    index = _shared_indexes.get(file_path)
+    if index is None:
+        with _shared_lock:
+            index = _shared_indexes.get(file_path)
+            if index is None:
+                index = EcoIndex.load(file_path)
+                _shared_indexes[file_path] = index
+    return index
+
+
+if __name__ == "__main__":
+    import sys
+    book_path = sys.argv[1] if len(sys.argv) > 1 else 'book/scid.eco'
+    EcoIndex.write(book_path, f"{book_path}.idx")
+    print(f"Compiled {len(EcoIndex.load(book_path))} openings from {book_path}")
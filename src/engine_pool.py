@@ -0,0 +1,128 @@
+import os
+import asyncio
+import logging
+import contextlib
+import chess
+import chess.engine
+from eval_cache import EvalCache
+
+logger = logging.getLogger(__name__)
+
+
+class EnginePool:
+    def __init__(self, engine_path, size=None, threads=1, hash_mb=64, options=None, max_pending=None,
+                 timeout=None, retries=1):
+        self.engine_path = engine_path
+        self.size = size or os.cpu_count() or 1
+        self.options = {'Threads': threads, 'Hash': hash_mb, **(options or {})}
+        self.timeout = timeout  # Default per-job timeout in seconds
+        self.retries = retries  # Times a job is retried on a fresh engine after a crash
+
+        self.idle = asyncio.Queue()
+        self.transports = {}  # Maps engine protocol to its subprocess transport
+        # Bounds the jobs that are running or waiting for an engine; callers block beyond that
+        self.pending = asyncio.Semaphore(max_pending or self.size * 4)
+        self.engine_name = None  # Known after the first handshake
+        self.spawned = 0  # Engines running or being spawned; grows on demand up to size
+        self.respawns = 0
+        self.closed = False
+
+    @property
+    def engine_key(self):
+        return EvalCache.engine_key(self.engine_name or self.engine_path, self.options)
+
+    @property
+    def ready(self):
+        return self.engine_name is not None
+
+    async def start(self, engines=None):
+        # Spawns `engines` now (all of them by default); acquire spawns the rest when jobs queue up
+        count = self.size if engines is None else min(engines, self.size)
+        self.spawned += count
+        try:
+            spawned = await asyncio.gather(*(self._spawn() for _ in range(count)))
+        except Exception:
+            self.spawned -= count
+            raise
+        for engine in spawned:
+            self.idle.put_nowait(engine)
+        logger.info(f"Engine pool started with {count} of {self.size} x {self.engine_name}")
+        return self
+
+    async def wait_ready(self):
+        # The first handshake names the engine, which eval cache keys depend on
+        if not self.ready:
+            async with self.acquire():
+                pass
+
+    async def _spawn(self):
+        transport, engine = await chess.engine.popen_uci(self.engine_path)
+        # Only send options this engine actually understands
+        options = {name: value for name, value in self.options.items() if name in engine.options}
+        if options:
+            await engine.configure(options)
+        self.engine_name = engine.id.get('name', self.engine_path)
+        self.transports[engine] = transport
+        return engine
+
+    async def _discard(self, engine):
+        transport = self.transports.pop(engine, None)
+        try:
+            await asyncio.wait_for(engine.quit(), 1)
+        except Exception:
+            pass
+        if transport:
+            transport.close()
+
+    async def _respawn(self, engine):
+        await self._discard(engine)
+        if self.closed:
+            return
+        self.respawns += 1
+        try:
+            self.idle.put_nowait(await self._spawn())
+        except Exception as e:
+            # Don't mask the job's own error; the pool runs one engine short until acquire spawns another
+            self.spawned -= 1
+            logger.error(f"Failed to respawn engine: {e}")
+
+    @contextlib.asynccontextmanager
+    async def acquire(self):
+        async with self.pending:
+            if self.idle.empty() and self.spawned < self.size:
+                # Lazy growth: nothing idle and room for another engine, so start one for this job
+                self.spawned += 1
+                try:
+                    engine = await self._spawn()
+                except Exception:
+                    self.spawned -= 1
+                    raise
+            else:
+                engine = await self.idle.get()
+            healthy = True
+            try:
+                yield engine
+            except (chess.engine.EngineError, chess.engine.EngineTerminatedError, asyncio.TimeoutError):
+                healthy = False
+                raise
+            finally:
+                # Cancelled searches are stopped by python-chess itself, so only crashes and hangs need a new engine
+                if healthy and not self.closed:
+                    self.idle.put_nowait(engine)
+                else:
+                    await self._respawn(engine)
+
+    async def analyse(self, board, limit, timeout=None, **kwargs):
+        timeout = timeout if timeout is not None else self.timeout
+        for attempt in range(self.retries + 1):
+            try:
+                async with self.acquire() as engine:
+                    return await asyncio.wait_for(engine.analyse(board, limit, **kwargs), timeout)
+            except chess.engine.EngineTerminatedError as e:
+                if attempt == self.retries:
+                    raise
+                logger.warning(f"Engine crashed, retrying on a fresh engine: {e}")
+
+    async def close(self):
+        self.closed = True
+        await asyncio.gather(*(self._discard(engine) for engine in list(self.transports)))
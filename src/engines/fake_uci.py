@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+# Deterministic stand-in for a UCI engine, so engine-bound code can be tested and timed offline.
+# The same position and limit always produce the same info lines, scores, node counts and best move.
+import sys
+import time
+import argparse
+import threading
+import chess
+import chess.polyglot
+
+PIECE_VALUES = {chess.PAWN: 100, chess.KNIGHT: 300, chess.BISHOP: 300, chess.ROOK: 500, chess.QUEEN: 900}
+NODES_PER_DEPTH = 1000
+
+
+class FakeEngine:
+    def __init__(self, delay=0):
+        self.board = chess.Board()
+        self.options = {'Hash': 16, 'Threads': 1, 'MultiPV': 1, 'Delay': delay}  # Delay: milliseconds per depth
+        self.stop_event = threading.Event()
+        self.search_thread = None
+
+    def send(self, line):
+        sys.stdout.write(line + '\n')
+        sys.stdout.flush()
+
+    def evaluate(self, board):
+        # Material from the side to move plus a small position-dependent offset
+        score = sum(value * (len(board.pieces(piece, board.turn)) - len(board.pieces(piece, not board.turn)))
+                    for piece, value in PIECE_VALUES.items())
+        return score + chess.polyglot.zobrist_hash(board) % 21 - 10
+
+    def ranked_moves(self, board):
+        # Best first: the move leaving the opponent worst off, ties broken by UCI for determinism
+        scored = []
+        for move in board.legal_moves:
+            board.push(move)
+            scored.append((self.evaluate(board), move.uci(), move))
+            board.pop()
+        scored.sort()
+        return [move for _, _, move in scored]
+
+    def search(self, board, depth, nodes, movetime):
+        started = time.monotonic()
+        moves = self.ranked_moves(board)
+        lines = min(self.options['MultiPV'], len(moves)) or 1
+        best = moves[0].uci() if moves else '0000'
+
+        # Lines are the same at every depth; only the score and counters grow
+        pvs = []
+        for move in moves[:lines]:
+            board.push(move)
+            pvs.append((-self.evaluate(board), ' '.join(m.uci() for m in [move, *self.ranked_moves(board)[:1]])))
+            board.pop()
+
+        for current in range(1, depth + 1):
+            if self.stop_event.is_set():
+                break
+            if nodes and current * NODES_PER_DEPTH > nodes and current > 1:
+                break
+            if movetime and (time.monotonic() - started) * 1000 >= movetime:
+                break
+            if self.options['Delay']:
+                time.sleep(self.options['Delay'] / 1000)
+
+            searched = current * NODES_PER_DEPTH
+            elapsed_ms = max(1, int((time.monotonic() - started) * 1000))
+            for index in range(lines):
+                if not moves:
+                    score = 'mate 0' if board.is_checkmate() else 'cp 0'
+                    self.send(f"info depth {current} seldepth {current} multipv 1 score {score} nodes {searched} "
+                              f"nps {searched * 1000 // elapsed_ms} time {elapsed_ms}")
+                    break
+                score, pv = pvs[index]
+                self.send(f"info depth {current} seldepth {current} multipv {index + 1} score cp {score + current} "
+                          f"nodes {searched} nps {searched * 1000 // elapsed_ms} time {elapsed_ms} pv {pv}")
+
+        self.send(f"bestmove {best}")
+
+    def go(self, tokens):
+        def value(name, default=None):
+            return int(tokens[tokens.index(name) + 1]) if name in tokens else default
+
+        depth = value('depth', 64 if 'infinite' in tokens else 20)
+        self.stop_search()
+        self.stop_event.clear()
+        self.search_thread = threading.Thread(
+            target=self.search, args=(self.board.copy(), depth, value('nodes'), value('movetime')))
+        self.search_thread.start()
+
+    def stop_search(self):
+        if self.search_thread is not None:
+            self.stop_event.set()
+            self.search_thread.join()
+            self.search_thread = None
+
+    def position(self, tokens):
+        if tokens[1] == 'startpos':
+            self.board = chess.Board()
+            rest = tokens[2:]
+        else:
+            moves_at = tokens.index('moves') if 'moves' in tokens else len(tokens)
+            self.board = chess.Board(' '.join(tokens[2:moves_at]))
+            rest = tokens[moves_at:]
+        if rest and rest[0] == 'moves':
+            for move in rest[1:]:
+                self.board.push_uci(move)
+
+    def setoption(self, tokens):
+        if 'value' in tokens:
+            name = ' '.join(tokens[2:tokens.index('value')])
+            if name in self.options:
+                self.options[name] = int(tokens[tokens.index('value') + 1])
+
+    def run(self):
+        for line in iter(sys.stdin.readline, ''):
+            tokens = line.split()
+            if not tokens:
+                continue
+            command = tokens[0]
+            if command == 'uci':
+                self.send("id name FakeEngine")
+                self.send("id author shiro")
+                self.send("option name Hash type spin default 16 min 1 max 33554432")
+                self.send("option name Threads type spin default 1 min 1 max 1024")
+                self.send("option name MultiPV type spin default 1 min 1 max 500")
+                self.send(f"option name Delay type spin default {self.options['Delay']} min 0 max 10000")
+                self.send("uciok")
+            elif command == 'isready':
+                self.send("readyok")
+            elif command == 'setoption':
+                self.setoption(tokens)
+            elif command == 'ucinewgame':
+                self.board = chess.Board()
+            elif command == 'position':
+                self.position(tokens)
+            elif command == 'go':
+                self.go(tokens)
+            elif command == 'stop':
+                self.stop_search()
+            elif command == 'quit':
+                break
+        self.stop_search()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Deterministic UCI engine for tests and benchmarks")
+    parser.add_argument('--delay', type=int, default=0, help="milliseconds per depth, to mimic a real search")
+    FakeEngine(parser.parse_args().delay).run()
@@ -0,0 +1,144 @@
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+import chess
+import chess.engine
+import chess.polyglot
+
+logger = logging.getLogger(__name__)
+
+
+class EvalCache:
+    def __init__(self, max_entries=100000, db_path=None, commit_every=100):
+        # (zobrist key, engine key) -> (depth, cp, mate, pv, nodes), scores from White's point of view
+        self.entries = OrderedDict()
+        self.max_entries = max_entries
+        self.commit_every = commit_every
+        self.pending_writes = 0
+        self.hits = 0
+        self.misses = 0
+
+        self.db = None
+        if db_path:
+            self.db = sqlite3.connect(db_path, check_same_thread=False)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("""
+                CREATE TABLE IF NOT EXISTS evals (
+                    key INTEGER NOT NULL,
+                    engine TEXT NOT NULL,
+                    depth INTEGER NOT NULL,
+                    cp INTEGER,
+                    mate INTEGER,
+                    pv TEXT,
+                    nodes INTEGER,
+                    PRIMARY KEY (key, engine)
+                ) WITHOUT ROWID
+            """)
+            self.db.commit()
+
+    @staticmethod
+    def engine_key(name, options=None):
+        # Results are only interchangeable between identically configured engines
+        if not options:
+            return name
+        return name + ''.join(f";{option}={value}" for option, value in sorted(options.items()))
+
+    @staticmethod
+    def position_key(board):
+        return chess.polyglot.zobrist_hash(board)
+
+    @staticmethod
+    def _db_key(key):
+        # SQLite integers are signed 64-bit
+        return key - (1 << 64) if key >= (1 << 63) else key
+
+    @staticmethod
+    def _to_info(entry):
+        depth, cp, mate, pv, nodes = entry
+        score = chess.engine.Mate(mate) if mate is not None else chess.engine.Cp(cp)
+        return {
+            'score': chess.engine.PovScore(score, chess.WHITE),
+            'depth': depth,
+            'pv': [chess.Move.from_uci(move) for move in pv.split()] if pv else [],
+            'nodes': nodes,
+            'cached': True,
+        }
+
+    def get(self, board, engine_key):
+        key = (self.position_key(board), engine_key)
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+        elif self.db is not None:
+            row = self.db.execute(
+                "SELECT depth, cp, mate, pv, nodes FROM evals WHERE key = ? AND engine = ?",
+                (self._db_key(key[0]), engine_key)).fetchone()
+            if row is not None:
+                entry = row
+                self._remember(key, entry)
+
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return self._to_info(entry)
+
+    def put(self, board, engine_key, info):
+        score = info.get('score')
+        depth = info.get('depth')
+        if score is None or depth is None:
+            return
+
+        key = (self.position_key(board), engine_key)
+        cached = self.entries.get(key)
+        if cached is not None and cached[0] >= depth:
+            return
+
+        white = score.white()
+        pv = ' '.join(move.uci() for move in info.get('pv', []))
+        entry = (depth, white.score(), white.mate(), pv, info.get('nodes'))
+        self._remember(key, entry)
+
+        if self.db is not None:
+            self.db.execute("""
+                INSERT INTO evals (key, engine, depth, cp, mate, pv, nodes) VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (key, engine) DO UPDATE SET
+                    depth = excluded.depth, cp = excluded.cp, mate = excluded.mate,
+                    pv = excluded.pv, nodes = excluded.nodes
+                WHERE excluded.depth > evals.depth
+            """, (self._db_key(key[0]), engine_key, *entry))
+            self.pending_writes += 1
+            if self.pending_writes >= self.commit_every:
+                self.flush()
+
+    def _remember(self, key, entry):
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def flush(self):
+        if self.db is not None and self.pending_writes:
+            self.db.commit()
+            self.pending_writes = 0
+
+    def close(self):
+        if self.db is not None:
+            self.flush()
+            self.db.close()
+            self.db = None
+
+
+_shared_cache = None
+_shared_lock = threading.Lock()
+
+
+def get_eval_cache(db_path=None):
+    # The first caller decides whether the process-wide cache is backed by disk
+    global _shared_cache
+    if _shared_cache is None:
+        with _shared_lock:
+            if _shared_cache is None:
+                _shared_cache = EvalCache(db_path=db_path)
+    return _shared_cache
@@ -0,0 +1,84 @@
+import time
+import asyncio
+
+
+def score_payload(score):
+    # Always from White's point of view, so clients never have to flip signs
+    white = score.white()
+    return {'cp': white.score(), 'mate': white.mate()}
+
+
+def eval_payload(info, final=False):
+    payload = score_payload(info['score'])
+    payload.update({
+        'depth': info.get('depth'),
+        'seldepth': info.get('seldepth'),
+        'nodes': info.get('nodes'),
+        'nps': info.get('nps'),
+        'pv': [move.uci() for move in info.get('pv', [])],
+        'final': final,
+        'received_at': time.time(),  # When the server got this info from the engine, for client-side latency
+    })
+    return payload
+
+
+class EvalThrottle:
+    def __init__(self, max_rate=10, score_threshold=15, flush=None):
+        self.min_interval = 1 / max_rate if max_rate else 0
+        self.score_threshold = score_threshold  # Centipawns
+        self.flush = flush  # Called with a held-back significant payload once the interval has passed
+        self.last_sent = None
+        self.last_sent_at = 0.0
+        self.pending = None  # Newest payload that was held back
+        self.timer = None
+
+    def _significant(self, payload):
+        last = self.last_sent
+        if last is None:
+            return True
+        if (payload['depth'] or 0) > (last['depth'] or 0):
+            return True
+        if payload['mate'] != last['mate']:
+            return True
+        if payload['cp'] is not None and last['cp'] is not None:
+            return abs(payload['cp'] - last['cp']) >= self.score_threshold
+        return False
+
+    def offer(self, payload, now=None):
+        # Returns the payload to send now, or None when it should be held back
+        now = time.monotonic() if now is None else now
+        self.pending = payload
+        if not self._significant(payload):
+            return None
+        if now - self.last_sent_at < self.min_interval:
+            # Trailing edge: without it a held change waits for the next info line, seconds at high depth
+            if self.flush is not None and self.timer is None:
+                delay = self.last_sent_at + self.min_interval - now
+                self.timer = asyncio.get_running_loop().call_later(delay, self._flush_pending)
+            return None
+        return self._sent(payload, now)
+
+    def _flush_pending(self):
+        self.timer = None
+        payload = self.pending
+        if payload is not None and self._significant(payload):
+            self.flush(self._sent(payload, time.monotonic()))
+
+    def cancel(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+
+    def finish(self, now=None):
+        # The last result always goes out, marked final, even if it repeats what was already sent
+        self.cancel()
+        last = self.pending or self.last_sent
+        if last is None or last['final']:
+            return None
+        return self._sent(dict(last, final=True), time.monotonic() if now is None else now)
+
+    def _sent(self, payload, now):
+        self.last_sent = payload
+        self.last_sent_at = now
+        self.pending = None
+        return payload
@@ -1,13 +1,28 @@
 import io
+import time
 import random
-import json
 import hashlib
 import copy
 import asyncio
 import logging
+import contextlib
+import functools
 import chess
 import chess.engine
 import chess.pgn
+import metrics
+from game_tree import GameTreeModel
+from eco_index import get_eco_index, iter_eco_openings, parse_opening_line
+from polyglot_book import get_polyglot_book
+from eval_cache import EvalCache, get_eval_cache
+from evaluation import EvalThrottle, eval_payload
+from analysis_scheduler import AnalysisScheduler
+from adaptive_review import AdaptiveReview
+from sequential_review import SequentialReview
+from tree_analysis import TreeAnalysis
+from tracing import traced_methods
+# tree_store, position_index and move_classification pull in numpy and SQLite, so they are imported
+# where they are used instead of on every server start
 
 class OpeningNode:
     def __init__(self):
@@ -29,26 +44,8 @@ class OpeningNode:
     @staticmethod
     def build_opening_tree(eco_book):
         root = OpeningNode()
-        current_opening_lines = ''
-
-        for line in eco_book.splitlines():
-            if line.startswith(tuple("ABCDE")) and '*' in current_opening_lines:
-                # Parse the current opening
-                code, name, moves = OpeningNode.parse_opening_line(current_opening_lines)
-                move_list = moves.split()
-                root.add_opening(move_list, code, name)
-                # Reset for the next opening
-                current_opening_lines = line
-            else:
-                # Continue building the current opening
-                current_opening_lines += ' ' + line
-
-        # Process the last opening if it exists
-        if current_opening_lines:
-            code, name, moves = OpeningNode.parse_opening_line(current_opening_lines)
-            move_list = moves.split()
-            root.add_opening(move_list, code, name)
-
+        for code, name, moves in iter_eco_openings(eco_book):
+            root.add_opening(moves.split(), code, name)
         return root
 
     def find_opening(self, move_list):
@@ -80,12 +77,7 @@ class OpeningNode:
 
     @staticmethod
     def parse_opening_line(line):
-        parts = line.split('"')
-        code = parts[0].strip()
-        name = parts[1].strip()
-        moves = parts[2].split('*')[0].strip()
-        # print(f"Parsed opening: Code={code}, Name={name}, Moves={moves}")
-        return code, name, moves
+        return parse_opening_line(line)
 
     def print_opening_book(self, move_sequence=''):
         if self.openings:
@@ -98,101 +90,169 @@ class OpeningNode:
             node.print_openings(move_sequence + ' ' + move)
 
 
+@traced_methods
 class GameBoard:
-    def __init__(self, engine_name=None, callback=None, eval_callback=None):
+    def __init__(self, engine_name=None, callback=None, eval_callback=None, eval_cache=None, engine_pool=None,
+                 max_eval_rate=10, eval_score_threshold=15, multipv=1):
         self.logger = logging.getLogger(__name__)
         self.game = None
         self.board = chess.Board()
-        self.opening_node = OpeningNode().load_eco_book()
+        self.current_node = None
+        self.eco_book_path = 'book/scid.eco'
+        self.node_openings = None  # Maps chess.pgn node to its ECO classification
+        self.book_directory = 'book/polyglot-collection'
+        self.position_index_path = 'games.sqlite'
 
         self.engine_path = f"engines/{engine_name}" if engine_name else None
         self.engine = None
+        self.engine_start = None  # Private engine's handshake, awaited by whatever needs the engine
         self.transport = None
-
-        self.background_analysis_task = None
-        self.prev_state_hash = None
+        self.eval_cache = eval_cache or get_eval_cache()
+        self.engine_pool = engine_pool  # Shared EnginePool used instead of a private engine when set
+
+        self.analysis_scheduler = None  # Owns the single background search once analysis is started
+        self.multipv = multipv  # Lines searched and streamed by background analysis
+        self.analysis_board = None  # Position of the latest background search
+        self.analysis_lines = {}  # Latest engine info per MultiPV line for analysis_board
+        self.tree_model = GameTreeModel()
+        self.tree_analysis = None  # Annotates every node of the tree with [%eval] once started
+        self.study = None  # TreeStore the current game is lazily loaded from, if any
         self.state_callback = callback
         self.eval_callback = eval_callback
+        self.max_eval_rate = max_eval_rate  # Eval updates per second sent to eval_callback
+        self.eval_score_threshold = eval_score_threshold  # Centipawn change that counts as a new eval
         self.reset_board()
 
         if self.engine_path:
-            asyncio.create_task(self.init_engine())
+            self.engine_start = asyncio.create_task(self.init_engine())
 
     def pgn_to_game(self, pgn_string):
         try:
-            pgn_io = io.StringIO(pgn_string)
-            self.game = chess.pgn.read_game(pgn_io)
-            new_state = self.has_state_changed()
-            if new_state and self.state_callback is not None:
-                asyncio.create_task(self.state_callback(new_state))
-        
-            if self.background_analysis_task:
-                asyncio.create_task(self.restart_background_analysis())
+            with metrics.pgn_parse_seconds.time():
+                pgn_io = io.StringIO(pgn_string)
+                self.game = chess.pgn.read_game(pgn_io)
+                self._close_study()
+                self.board = self.game.board()
+                self.current_node = self.game
+                self.node_openings = None
+                self._publish_tree_event(self.tree_model.reset(self.game))
+
+            self._position_changed()
             return self.game
         except Exception as e:
             self.logger.error(f"Error parsing PGN string: {e}")
             return None
 
+    def open_study(self, path):
+        # Memory-mapped: only the nodes the user navigates to are ever built
+        try:
+            from tree_store import TreeStore
+            store = TreeStore.open(path)
+            self._close_study()
+            store.on_load = self.tree_model.loaded
+            self.study = store
+            self.game = store.game()
+            self.board = self.game.board()
+            self.current_node = self.game
+            self.node_openings = None
+            self._publish_tree_event(self.tree_model.reset(self.game))
+
+            self._position_changed()
+            return self.game
+        except Exception as e:
+            self.logger.error(f"Error opening study {path}: {e}")
+            return None
+
+    def save_study(self, path):
+        try:
+            from tree_store import TreeStore
+            TreeStore.write(self.game, path)
+            return True
+        except Exception as e:
+            self.logger.error(f"Error saving study {path}: {e}")
+            return False
+
+    def _close_study(self):
+        # Nodes already built keep working; only further lazy loads need the store
+        if self.study is not None:
+            self.study.on_load = None
+            self.study = None
+
     def reset_board(self):
         self.board.reset()
+        self._close_study()
         self.game = chess.pgn.Game()
-        new_state = self.has_state_changed()
-        if new_state and self.state_callback is not None:
-            asyncio.create_task(self.state_callback(new_state))
-    
-        if self.background_analysis_task:
-            asyncio.create_task(self.restart_background_analysis())
-
-    def _generate_state_hash(self):
-        game_tree = self.list_variations()
-        game_tree_string = json.dumps(game_tree)  # Convert the dict to a JSON string
-        # return hashlib.sha256(game_tree_string.encode()).hexdigest()
-        return game_tree_string
-
-    def has_state_changed(self):
-        # Check if the current game state is different from the previous state
-        current_state_hash = self._generate_state_hash()
-        if current_state_hash != self.prev_state_hash:
-            self.prev_state_hash = current_state_hash
-            return current_state_hash
-        else:
-            return False
+        self.current_node = self.game
+        self.node_openings = None
+        self._publish_tree_event(self.tree_model.reset(self.game))
+
+        self._position_changed()
+
+    def _position_changed(self):
+        if self.analysis_scheduler is not None:
+            self.analysis_scheduler.request(self.board)
+        if self.tree_analysis is not None:
+            self.tree_analysis.cursor_moved(self.current_node)
+
+    def _publish_tree_event(self, event):
+        if self.tree_analysis is not None and event['type'] != 'eval':
+            self.tree_analysis.tree_changed(self.game, self.current_node)
+        if self.state_callback is not None:
+            asyncio.create_task(self.state_callback(event))
+
+    def get_tree_snapshot(self):
+        with metrics.tree_serialization_seconds.time():
+            return self.tree_model.snapshot(self.game)
 
     def get_current_fen(self):
         return self.board.fen()
 
     def _get_current_node(self):
-        node = self.game
-        for move in self.board.move_stack:
-            for var in node.variations:
-                if var.move == move:
-                    node = var
-                    break
-        return node
+        return self.current_node
+
+    def _push_node(self, node):
+        self.board.push(node.move)
+        self.current_node = node
+
+    def _pop_node(self):
+        move = self.board.pop()
+        self.current_node = self.current_node.parent
+        return move
 
     def navigate_forward(self):
         current_node = self._get_current_node()
         if current_node.variations:
             next_move = current_node.variations[0].move
-            self.board.push(next_move)
-            if self.background_analysis_task:
-                asyncio.create_task(self.restart_background_analysis())
+            self._push_node(current_node.variations[0])
+            self._position_changed()
             return next_move.uci()
         return None
 
     def navigate_backward(self):
         if self.board.move_stack:
-            last_move = self.board.pop()
-            if self.background_analysis_task:
-                asyncio.create_task(self.restart_background_analysis())
+            last_move = self._pop_node()
+            self._position_changed()
             return last_move.uci()
         return None
 
+    def navigate_to_node(self, node_id):
+        node = self.tree_model.lookup(node_id)
+        if node is None:
+            return None
+        self.board = node.board()
+        self.current_node = node
+        self._position_changed()
+        return node_id
+
     def _make_move(self, uci_move):
         try:
             move = chess.Move.from_uci(uci_move)
             if move in self.board.legal_moves:
-                self.board.push(move)
+                node = self.current_node.variation(move) if self.current_node.has_variation(move) \
+                    else self._add_variation(self.current_node, uci_move)
+                if node is None:
+                    return False
+                self._push_node(node)
                 return True
             else:
                 self.logger.warning(f"Illegal move: {uci_move}")
@@ -205,32 +265,28 @@ class GameBoard:
         current_node = self._get_current_node()
         move = chess.Move.from_uci(uci_move)
 
-        if move in [var.move for var in current_node.variations]:
-            self.board.push(move)
-            new_state = self.has_state_changed()
-            if new_state and self.state_callback is not None:
-                asyncio.create_task(self.state_callback(new_state))
+        if current_node.has_variation(move):
+            self._push_node(current_node.variation(move))
         elif move not in self.board.legal_moves:
             self.logger.warning(f"Illegal move: {uci_move}")
             return False
         else:
-            self._add_variation(current_node, uci_move)
-            self.board.push(move)
-            new_state = self.has_state_changed()
-            if new_state and self.state_callback is not None:
-                asyncio.create_task(self.state_callback(new_state))
-        
-        if self.background_analysis_task:
-            asyncio.create_task(self.restart_background_analysis())
+            new_variation = self._add_variation(current_node, uci_move)
+            if new_variation is None:
+                return False
+            self._push_node(new_variation)
+
+        self._position_changed()
         return True
 
     def undo_move(self):
         if len(self.board.move_stack) > 0:
-            self.board.pop()
+            self._pop_node()
 
     def _add_variation(self, current_node, move, comment=''):
         try:
             new_variation = current_node.add_variation(chess.Move.from_uci(move), comment=comment)
+            self._publish_tree_event(self.tree_model.added(new_variation))
             return new_variation
         except Exception as e:
             self.logger.error(f"Error adding variation: {e}")
@@ -239,75 +295,41 @@ class GameBoard:
     def _promote_variation(self, node):
         try:
             node.parent.promote(node.move)
+            self._publish_tree_event(self.tree_model.promoted(node))
         except Exception as e:
             self.logger.error(f"Error promoting variation: {e}")
 
-    def list_variations(self, node=None, depth=0, variation_lines=None):
-        if variation_lines is None:
-            variation_lines = []
-        
-        if node is None:
-            node = self.game
-
-        indent = " " * (2 * depth)
-        for variation in node.variations:
-            variation_line = f"{indent}Variation at depth {depth}: {variation.move.uci()}"
-            variation_lines.append(variation_line)
-            self.list_variations(variation, depth + 1, variation_lines)
-
-        # Only return the result at the root call
-        if depth == 0:
-            return self._parse_to_tree(variation_lines)
-
-    @staticmethod
-    def _parse_to_tree(variation_lines):
-        variation_string = "\n".join(variation_lines)  # Join the list into a single string
-        lines = variation_string.split('\n')
-        root = {'name': 'Start', 'children': []}
-        stack = [root]
-
-        for line in lines:
-            if not line.strip():
-                continue
-
-            depth = line.count('  ')
-            move_san = line.split(': ')[-1]
-            
-            node = {'name': move_san, 'children': []}
-
-            # Move back up to the parent node at the correct depth
-            while len(stack) > depth + 1:
-                stack.pop()
-            
-            # Add the new node to the children of the current node
-            stack[-1]['children'].append(node)
-
-            # Add this node to the stack
-            stack.append(node)
+    def _remove_variation(self, node):
+        try:
+            parent = node.parent
+            # Step the board back out of the removed subtree before dropping it
+            current_node = self._get_current_node()
+            ancestor = current_node
+            while ancestor is not None and ancestor is not node:
+                ancestor = ancestor.parent
+            moved = ancestor is node
+            if moved:
+                for _ in range(current_node.ply() - parent.ply()):
+                    self._pop_node()
+            self._publish_tree_event(self.tree_model.removed(node))
+            parent.remove_variation(node.move)
+            if moved:
+                self._position_changed()
+        except Exception as e:
+            self.logger.error(f"Error removing variation: {e}")
 
-        return root
+    def list_variations(self):
+        return self.tree_model.build_tree(self.game)
 
     def _navigate_to_node(self, path):
-        current_node = self.game
-        try:
-            for move in path:
-                found = False
-                for variation in current_node.variations:
-                    if variation.move == chess.Move.from_uci(move):
-                        current_node = variation
-                        found = True
-                        break
-                if not found:
-                    return None
-            return current_node
-        except Exception as e:
-            self.logger.error(f"Error navigating to node: {e}")
-            return None
+        return self.tree_model.lookup(" ".join(path))
 
     def _annotate_move(self, node, comment='', nags=[]):
         try:
-            if comment:
-                node.comment = comment
+            # Added after what the node already says, so user text and [%eval]/[%clk] survive;
+            # a repeated review does not add the same text twice
+            if comment and comment not in node.comment:
+                node.comment = f"{node.comment} {comment}" if node.comment else comment
             for nag in nags:
                 node.nags.add(nag)
         except Exception as e:
@@ -318,26 +340,53 @@ class GameBoard:
             score = evaluation.get("score")
             depth = evaluation.get("depth", None)
             node.set_eval(score, depth)
+            self._publish_tree_event(self.tree_model.evaluated(node))
         except Exception as e:
             self.logger.error(f"Error adding evaluation to node: {e}")
 
-    def get_opening(self):
-        board = self.game.board()
-        moves_with_prefixes = []
-        move_count = 1  # Start with move number 1
-
-        for move in self.game.mainline_moves():
-            san_move = board.san(move)
-            # Add move number prefixes for each move (1.e4, 2.Nf3, etc.)
-            move_with_prefix = f"{move_count}.{san_move}" if board.turn == chess.WHITE else san_move
-            moves_with_prefixes.append(move_with_prefix)
-            # print(f"PGN move with prefix: {move_with_prefix}")
-            board.push(move)
-            if board.turn == chess.WHITE:
-                move_count += 1  # Increment move count after black's move
+    def get_opening(self, node=None):
+        # Defaults to the end of the mainline; any tree node can be classified
+        node = node or self.game.end()
+        index = get_eco_index(self.eco_book_path)
+        if self.node_openings is None:
+            self.node_openings = index.classify_tree(self.game)
+
+        if node not in self.node_openings:
+            # Nodes added since the last full pass: only classify the missing part of the path
+            missing = []
+            ancestor = node
+            while ancestor not in self.node_openings:
+                missing.append(ancestor)
+                ancestor = ancestor.parent
+            board = ancestor.board()
+            for child in reversed(missing):
+                board.push(child.move)
+                named = index.classify(board) if child.ply() <= index.max_ply else None
+                self.node_openings[child] = named or self.node_openings[child.parent]
+
+        return self.node_openings[node]
+
+    def _position_index_call(self, method, *args):
+        # Runs in a worker thread: opening the index (SQLite connect, DDL, pragmas) must not block the loop either
+        from position_index import get_position_index
+        return getattr(get_position_index(self.position_index_path), method)(*args)
+
+    async def search_position(self, node=None, limit=20):
+        # Reference games through the current (or given) position; SQLite work stays off the event loop
+        board = node.board() if node is not None else self.board.copy()
+        return await asyncio.to_thread(self._position_index_call, 'search', board, limit)
+
+    async def explore(self, node=None, top_games=8):
+        # Explorer statistics from the aggregate table, named with the bundled ECO data
+        board = node.board() if node is not None else self.board.copy()
+        result = await asyncio.to_thread(self._position_index_call, 'explore', board, top_games)
+        result['opening'] = self.get_opening(node or self.current_node)
+        return result
+
+    def get_book_moves(self, node=None):
+        board = node.board() if node is not None else self.board
+        return get_polyglot_book(self.book_directory).probe(board)
 
-        return self.opening_node.find_opening(moves_with_prefixes)
-        
     async def init_engine(self):
         if not self.engine:
             try:
@@ -358,60 +407,272 @@ class GameBoard:
             self.transport.close()
             self.transport = None
 
-    async def board_eval(self, position_fen):
-        self.board.set_fen(position_fen)
-        info = await self.engine.analyse(self.board, chess.engine.Limit(depth=20))
+    async def _engine_ready(self):
+        # Engine work waits for the handshake instead of racing it
+        if self.engine_pool is not None:
+            await self.engine_pool.wait_ready()
+        elif self.engine is None and self.engine_start is not None:
+            await self.engine_start
+
+    def _engine_key(self):
+        if self.engine_pool is not None:
+            return self.engine_pool.engine_key
+        return EvalCache.engine_key(self.engine.id.get('name', self.engine_path))
+
+    @contextlib.asynccontextmanager
+    async def _analysis_engine(self):
+        if self.engine_pool is not None:
+            async with self.engine_pool.acquire() as engine:
+                yield engine
+        else:
+            yield self.engine
+
+    async def _cached_analyse(self, board, depth, limit=None):
+        # Answer from the cache unless it only holds a shallower search
+        await self._engine_ready()
+        engine_key = self._engine_key()
+        cached = self.eval_cache.get(board, engine_key)
+        if cached is not None and cached['depth'] >= depth:
+            return cached
+        limit = limit or chess.engine.Limit(depth=depth)
+        if self.engine_pool is not None:
+            info = await self.engine_pool.analyse(board, limit)
+        else:
+            info = await self.engine.analyse(board, limit)
+        self.eval_cache.put(board, engine_key, info)
         return info
 
-    async def game_review(self, game):
+    async def board_eval(self, position_fen):
+        # Any position, analysed on its own board: the session's board and cursor stay where they are
+        return await self._cached_analyse(chess.Board(position_fen), 20)
+
+    async def game_review(self, game, time_budget=None, node_budget=None, order=None):
         analysis_results = []
+        positions = []
 
         board = game.board()
+        book = get_polyglot_book(self.book_directory)
+        in_book = True
+        entry = board.copy()  # Last book position, or the start: the baseline for the first move out of book
 
         for move in game.mainline_moves():
             board.push(move)
-            info = await self.engine.analyse(board, chess.engine.Limit(depth=18))
+            # Book positions need no engine time; once out of book, stop probing
+            in_book = in_book and book.contains(board)
+            if in_book:
+                analysis_results.append({'score': None, 'move': move, 'book': True})
+                entry = board.copy()
+            else:
+                positions.append((move, board.copy()))
+        boards = [entry] + [board for _, board in positions] if positions else []
+
+        if time_budget is not None or node_budget is not None:
+            # Shallow pass over every ply, then the rest of the budget goes to the critical ones
+            review = AdaptiveReview(
+                lambda board, limit: self._cached_analyse(board, limit.depth, limit),
+                time_budget=time_budget, node_budget=node_budget,
+                concurrency=self.engine_pool.size if self.engine_pool is not None else 1,
+            )
+            infos = await review.run(boards)
+        elif order is not None:
+            # One engine walks the whole game so its hash carries over from ply to ply
+            await self._engine_ready()
+            review = SequentialReview(order, eval_cache=self.eval_cache, engine_key=self._engine_key())
+            async with self._analysis_engine() as engine:
+                infos = await review.review_game(engine, game, chess.engine.Limit(depth=18),
+                                                 first_ply=len(analysis_results))
+            infos = [await self._cached_analyse(entry, 18)] + infos if positions else []
+        elif self.engine_pool is not None:
+            # Positions are independent jobs, so the pool spreads them across all its engines
+            infos = await asyncio.gather(*(self._cached_analyse(board, 18) for board in boards))
+        else:
+            infos = [await self._cached_analyse(board, 18) for board in boards]
 
-            adjusted_score = info['score'].white() if board.turn == chess.BLACK else -info['score'].black()
-            analysis_results.append({'score': adjusted_score, 'move': move})
+        for (move, board), info in zip(positions, infos[1:]):
+            analysis_results.append({'score': info['score'].white(), 'move': move})
+        if positions:
+            # The first move out of book is judged against the position it was played from
+            analysis_results[len(analysis_results) - len(positions)]['before'] = infos[0]['score'].white()
 
         return analysis_results
 
+    def annotate_review(self, game, analysis_results):
+        # Writes NAGs and comments for inaccuracies, mistakes and blunders, and returns per-player stats
+        from move_classification import LABELS, MoveClassifier, review_to_centipawns, review_entry, review_book
+        classifier = MoveClassifier()
+        cp = review_to_centipawns(analysis_results)
+        result = classifier.classify_batch(cp, [len(cp)], [game.board().turn == chess.WHITE],
+                                           entry=review_entry(analysis_results), book=review_book(analysis_results))
+        nodes = list(game.mainline())
+        for ply, nags, comment in classifier.annotations(result, cp):
+            self._annotate_move(nodes[ply], comment=comment, nags=nags)
+        return {
+            **classifier.summary(result),
+            'moves': [LABELS[code] for code in result['classification']],
+        }
+
     async def start_background_analysis(self, depth=20):
-        self.background_analysis_task = asyncio.create_task(self._background_analysis(depth))
+        if self.analysis_scheduler is None:
+            self.analysis_scheduler = AnalysisScheduler(lambda board: self._background_analysis(board, depth))
+            self.analysis_scheduler.start()
+        self.analysis_scheduler.request(self.board)
 
     async def stop_background_analysis(self):
-        if self.background_analysis_task:
-            self.background_analysis_task.cancel()
-            await self.background_analysis_task
+        if self.analysis_scheduler:
+            await self.analysis_scheduler.stop()
+            self.analysis_scheduler = None
 
     async def restart_background_analysis(self):
         await self.stop_background_analysis()
         await self.start_background_analysis()
 
-    async def _background_analysis(self, depth=20):
+    def start_tree_analysis(self, depth=16, workers=1):
+        # Needs its own engine time: on a private engine it would cancel the background search
+        if self.engine_pool is None:
+            self.logger.warning("Tree analysis needs an engine pool")
+            return
+        if self.tree_analysis is None:
+            self.tree_analysis = TreeAnalysis(self._cached_analyse, self._tree_evals_written,
+                                              depth=depth, workers=workers)
+        self.tree_analysis.start(self.game, self.current_node)
+
+    async def stop_tree_analysis(self):
+        if self.tree_analysis:
+            await self.tree_analysis.stop()
+            self.tree_analysis = None
+
+    def _tree_evals_written(self, nodes, info):
+        for node in nodes:
+            # Skip nodes removed from the tree while their position was being searched
+            if node in self.tree_model.ids:
+                self._publish_tree_event(self.tree_model.evaluated(node))
+
+    def _cache_line(self, board, engine_key, line, info):
+        if line == 1:
+            self.eval_cache.put(board, engine_key, info)
+        elif len(info['pv']) > 1 and info.get('depth', 0) > 1:
+            # A secondary line is also a search of the position after its first move, one ply shallower
+            child = board.copy(stack=False)
+            child.push(info['pv'][0])
+            self.eval_cache.put(child, engine_key, {
+                'score': info['score'],
+                'depth': info['depth'] - 1,
+                'pv': info['pv'][1:],
+                'nodes': info.get('nodes'),
+            })
+
+    def set_multipv(self, multipv):
+        self.multipv = max(1, int(multipv))
+        if self.analysis_scheduler is not None:
+            self.analysis_scheduler.request(self.board, force=True)
+
+    def expand_line(self, multipv=1):
+        # Adds a streamed engine line to the tree below the current node without a new search
+        info = self.analysis_lines.get(multipv)
+        if info is None or self.analysis_board is None or self.analysis_board.fen() != self.board.fen():
+            return None
+
+        node = self.current_node
+        for move in info['pv']:
+            node = node.variation(move) if node.has_variation(move) else self._add_variation(node, move.uci())
+            if node is None:
+                return None
+            if node.parent is self.current_node:
+                self._add_evaluation_to_node(node, info)
+        return self.tree_model.node_id(node)
+
+    async def _background_analysis(self, board, depth=20):
+        requested = time.perf_counter()
+        first_eval = True
+
+        async def send_eval(payload):
+            nonlocal first_eval
+            if first_eval:
+                first_eval = False
+                metrics.time_to_first_eval.observe(time.perf_counter() - requested)
+            await self.eval_callback(payload)
+
         try:
-            with await self.engine.analysis(self.board, chess.engine.Limit(depth=depth)) as analysis:
-                async for info in analysis:
-                    # print("Received update from engine:", info)
-                    score = info.get("score")
-                    pv = info.get("pv")
-                    engine_depth = info.get("depth")
-                    if score is not None and pv is not None:
-                        evaluation = {
-                            "score": str(score),
-                            "depth": engine_depth,
-                            # "pv": [str(move) for move in pv]
-                        }
-                        if self.eval_callback:
-                            await self.eval_callback(evaluation)
-                    else:
-                        self.logger.debug("Waiting for engine analysis...")
-
-                    if depth and info.get("depth", 0) >= depth:
-                        break
+            book_moves = get_polyglot_book(self.book_directory).probe(board)
+            if book_moves:
+                if self.eval_callback:
+                    await self.eval_callback({'book': True, 'moves': book_moves})
+                return
+
+            await self._engine_ready()
+            engine_key = self._engine_key()
+            multipv = self.multipv
+            self.analysis_board = board
+            self.analysis_lines = {}
+
+            cached = self.eval_cache.get(board, engine_key)
+            cached_depth = 0
+            if cached is not None:
+                cached_depth = cached['depth']
+                if cached['pv']:
+                    self.analysis_lines[1] = cached
+                # The cache only holds the best line, so MultiPV still needs a search for the others
+                done = depth and cached_depth >= depth and multipv == 1
+                if self.eval_callback:
+                    await send_eval(dict(eval_payload(cached, final=bool(done)), multipv=1))
+                if done:
+                    return
+
+            throttles = {}  # One throttle per MultiPV line, so lines update independently
+
+            def flush(line, evaluation):
+                if self.eval_callback:
+                    asyncio.create_task(send_eval(dict(evaluation, multipv=line)))
+
+            async with self._analysis_engine() as engine:
+                try:
+                    metrics.engine_searches_started.inc()
+                    nps = None
+                    with await engine.analysis(board, chess.engine.Limit(depth=depth), multipv=multipv) as analysis:
+                        async for info in analysis:
+                            nps = info.get("nps", nps)
+                            score = info.get("score")
+                            pv = info.get("pv")
+                            engine_depth = info.get("depth")
+                            line = info.get("multipv", 1)
+                            if score is not None and pv:
+                                self._cache_line(board, engine_key, line, info)
+                                # Only forward lines that improve on what the cache already showed
+                                if line > 1 or (engine_depth or 0) > cached_depth:
+                                    self.analysis_lines[line] = info
+                                    throttle = throttles.get(line)
+                                    if throttle is None:
+                                        throttle = throttles[line] = EvalThrottle(
+                                            self.max_eval_rate, self.eval_score_threshold,
+                                            flush=functools.partial(flush, line))
+                                    evaluation = throttle.offer(eval_payload(info))
+                                    if evaluation and self.eval_callback:
+                                        await send_eval(dict(evaluation, multipv=line))
+                            else:
+                                self.logger.debug("Waiting for engine analysis...")
+
+                            if depth and (engine_depth or 0) >= depth and line == multipv:
+                                break
+
+                    if nps:
+                        metrics.engine_nps.observe(nps)
+                    # The search finished: whatever the throttles held back goes out as the final evals.
+                    # A search that never got past the cached depth leaves the cached line as line 1's final
+                    if cached is not None and 1 not in throttles and self.eval_callback:
+                        await send_eval(dict(eval_payload(cached, final=True), multipv=1))
+                    for line, throttle in sorted(throttles.items()):
+                        evaluation = throttle.finish()
+                        if evaluation and self.eval_callback:
+                            await send_eval(dict(evaluation, multipv=line))
+                except asyncio.CancelledError:
+                    # Cancelled mid-search; the engine stops cleanly and stays usable
+                    metrics.engine_searches_cancelled.inc()
+                finally:
+                    # No held-back eval of an abandoned search may go out later
+                    for throttle in throttles.values():
+                        throttle.cancel()
         except asyncio.CancelledError:
-            # Analysis was cancelled
+            # Analysis was cancelled before it got an engine
             pass
         except Exception as e:
             self.logger.error(f"Error in background analysis: {e}")
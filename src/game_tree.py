@@ -0,0 +1,166 @@
+import chess
+
+
+class GameTreeModel:
+    def __init__(self):
+        self.seq = 0
+        self.nodes = {}  # Maps node id to chess.pgn node
+        self.ids = {}  # Maps chess.pgn node back to its node id
+
+    def node_id(self, node):
+        # A node is identified by the UCI path from the root, which stays stable across promotions
+        return self.ids[node]
+
+    def lookup(self, node_id):
+        node = self.nodes.get(node_id)
+        if node is not None or not node_id:
+            return node
+        # Snapshots of a lazily loaded study name nodes that were never built: walk to the id from its
+        # deepest indexed ancestor, which loads (and indexes) each node on the way
+        moves = node_id.split(' ')
+        for depth in range(len(moves) - 1, -1, -1):
+            parent_id = ' '.join(moves[:depth])
+            node = self.nodes.get(parent_id)
+            if node is not None:
+                break
+        else:
+            return None
+        for uci in moves[depth:]:
+            try:
+                child = node.variation(chess.Move.from_uci(uci))
+            except (KeyError, ValueError):
+                return None
+            child_id = self.path_id(parent_id, uci)
+            if child_id not in self.nodes:
+                self._index_subtree(child, child_id)
+            node, parent_id = child, child_id
+        return node
+
+    @staticmethod
+    def _loaded_variations(node):
+        # Nodes opened from a TreeStore load children on first access; only walk what already exists
+        return node.variations if getattr(node, 'loaded', True) else []
+
+    def _index_subtree(self, node, node_id):
+        stack = [(node, node_id)]
+        while stack:
+            node, node_id = stack.pop()
+            self.nodes[node_id] = node
+            self.ids[node] = node_id
+            for variation in self._loaded_variations(node):
+                stack.append((variation, self.child_id(node_id, variation.move)))
+
+    def _drop_subtree(self, node):
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            node_id = self.ids.pop(node, None)
+            if node_id is not None:
+                self.nodes.pop(node_id, None)
+            stack.extend(self._loaded_variations(node))
+
+    def loaded(self, node):
+        # Lazily loaded children are already part of the snapshot, so this only indexes them.
+        # Other games built from the same store (e.g. for to_pgn) are not part of this tree
+        node_id = self.ids.get(node)
+        if node_id is None:
+            return
+        for variation in node.variations:
+            self._index_subtree(variation, self.child_id(node_id, variation.move))
+
+    @staticmethod
+    def path_id(parent_id, uci):
+        return f"{parent_id} {uci}" if parent_id else uci
+
+    @classmethod
+    def child_id(cls, parent_id, move):
+        return cls.path_id(parent_id, move.uci())
+
+    @staticmethod
+    def eval_payload(node):
+        # The node's [%eval] annotation, from White's point of view
+        score = node.eval()
+        if score is None:
+            return None
+        white = score.white()
+        return {'cp': white.score(), 'mate': white.mate(), 'depth': node.eval_depth()}
+
+    def build_tree(self, game):
+        root = {'id': '', 'name': 'Start', 'children': []}
+        stack = [(game, root)]
+
+        while stack:
+            node, tree_node = stack.pop()
+            if not getattr(node, 'loaded', True):
+                tree_node['children'] = node.store.subtree(node.index, tree_node['id'], self.path_id)
+                continue
+            for variation in node.variations:
+                child = {
+                    'id': self.child_id(tree_node['id'], variation.move),
+                    'name': variation.move.uci(),
+                    'children': [],
+                }
+                evaluation = self.eval_payload(variation)
+                if evaluation is not None:
+                    child['eval'] = evaluation
+                tree_node['children'].append(child)
+                stack.append((variation, child))
+
+        return root
+
+    def snapshot(self, game):
+        return {'type': 'snapshot', 'seq': self.seq, 'tree': self.build_tree(game)}
+
+    def reset(self, game):
+        self.seq += 1
+        self.nodes.clear()
+        self.ids.clear()
+        self._index_subtree(game, '')
+        return self.snapshot(game)
+
+    def added(self, node):
+        self.seq += 1
+        parent_id = self.node_id(node.parent)
+        node_id = self.child_id(parent_id, node.move)
+        self._index_subtree(node, node_id)
+        return {
+            'type': 'add',
+            'seq': self.seq,
+            'id': node_id,
+            'parent': parent_id,
+            'name': node.move.uci(),
+            'index': node.parent.variations.index(node),
+        }
+
+    def removed(self, node):
+        self.seq += 1
+        node_id = self.node_id(node)
+        parent_id = self.node_id(node.parent)
+        self._drop_subtree(node)
+        return {
+            'type': 'remove',
+            'seq': self.seq,
+            'id': node_id,
+            'parent': parent_id,
+        }
+
+    def promoted(self, node):
+        self.seq += 1
+        parent_id = self.node_id(node.parent)
+        return {
+            'type': 'promote',
+            'seq': self.seq,
+            'id': self.child_id(parent_id, node.move),
+            'parent': parent_id,
+            'index': node.parent.variations.index(node),
+        }
+
+    def evaluated(self, node):
+        self.seq += 1
+        return {
+            'type': 'eval',
+            'seq': self.seq,
+            'id': self.node_id(node),
+            'parent': self.node_id(node.parent),
+            'eval': self.eval_payload(node),
+        }
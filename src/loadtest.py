@@ -0,0 +1,308 @@
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import logging
+import argparse
+import subprocess
+import chess.pgn
+from urllib.parse import urlsplit
+from wsproto import WSConnection, ConnectionType
+from wsproto.events import (AcceptConnection, RejectConnection, TextMessage, Ping, CloseConnection, Request,
+                            Message)
+from benchmark import FAKE_ENGINE, git_revision
+
+logger = logging.getLogger(__name__)
+
+ORIGIN = 'http://localhost:3000'  # The only origin the server's CORS policy accepts
+GAMES_PGN = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarks', 'games.pgn')
+
+
+def percentiles(samples):
+    if not samples:
+        return {'count': 0, 'p50_ms': None, 'p95_ms': None, 'p99_ms': None, 'max_ms': None}
+    ordered = sorted(samples)
+
+    def pick(fraction):
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] * 1000
+
+    return {'count': len(ordered), 'p50_ms': pick(0.5), 'p95_ms': pick(0.95), 'p99_ms': pick(0.99),
+            'max_ms': ordered[-1] * 1000}
+
+
+def load_scripts():
+    # One script per game: the moves played one by one, with a step back and forth every few moves
+    scripts = []
+    with open(GAMES_PGN) as pgn_file:
+        while True:
+            game = chess.pgn.read_game(pgn_file)
+            if game is None:
+                break
+            commands = []
+            for ply, move in enumerate(game.mainline_moves()):
+                commands.append({'move': move.uci()})
+                if ply % 6 == 5:
+                    commands.append({'navigate_backward': True})
+                    commands.append({'navigate_forward': True})
+            scripts.append((str(game), commands))
+    return scripts
+
+
+class WebSocketClient:
+    # Minimal asyncio websocket client on wsproto, which already ships with hypercorn
+    def __init__(self, reader, writer, connection):
+        self.reader = reader
+        self.writer = writer
+        self.connection = connection
+        self.messages = asyncio.Queue()  # (receipt time, decoded message)
+        self.closed = False
+        self.reader_task = asyncio.create_task(self._read())
+
+    @classmethod
+    async def connect(cls, host, port, target):
+        reader, writer = await asyncio.open_connection(host, port)
+        connection = WSConnection(ConnectionType.CLIENT)
+        writer.write(connection.send(Request(host=f"{host}:{port}", target=target,
+                                             extra_headers=[(b'origin', ORIGIN.encode())])))
+        await writer.drain()
+        while True:
+            data = await reader.read(65536)
+            if not data:
+                raise ConnectionError("Server closed the connection during the handshake")
+            connection.receive_data(data)
+            for event in connection.events():
+                if isinstance(event, AcceptConnection):
+                    return cls(reader, writer, connection)
+                if isinstance(event, RejectConnection):
+                    raise ConnectionError(f"Websocket rejected with status {event.status_code}")
+
+    async def _read(self):
+        parts = []
+        try:
+            while True:
+                data = await self.reader.read(65536)
+                if not data:
+                    break
+                received = time.time()
+                self.connection.receive_data(data)
+                for event in self.connection.events():
+                    if isinstance(event, TextMessage):
+                        parts.append(event.data)
+                        if event.message_finished:
+                            self.messages.put_nowait((received, json.loads(''.join(parts))))
+                            parts = []
+                    elif isinstance(event, Ping):
+                        self.writer.write(self.connection.send(event.response()))
+                    elif isinstance(event, CloseConnection):
+                        return
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            self.closed = True
+            self.messages.put_nowait((time.time(), None))
+
+    async def send(self, payload):
+        self.writer.write(self.connection.send(Message(data=json.dumps(payload))))
+        await self.writer.drain()
+
+    async def receive(self):
+        return await self.messages.get()
+
+    async def close(self):
+        self.reader_task.cancel()
+        try:
+            self.writer.write(self.connection.send(CloseConnection(code=1000)))
+            self.writer.close()
+            await self.writer.wait_closed()
+        except Exception:
+            pass
+
+
+async def http_request(host, port, method, target, payload=None):
+    # One request per connection, which keeps the client trivial and is cheap on localhost
+    body = json.dumps(payload).encode() if payload is not None else b''
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        writer.write(f"{method} {target} HTTP/1.1\r\nHost: {host}:{port}\r\nOrigin: {ORIGIN}\r\n"
+                     f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n"
+                     f"Connection: close\r\n\r\n".encode() + body)
+        await writer.drain()
+        response = await reader.read()
+    finally:
+        writer.close()
+    status = int(response.split(b' ', 2)[1])
+    return status, json.loads(response.split(b'\r\n\r\n', 1)[1] or b'null')
+
+
+class LoadClient:
+    def __init__(self, host, port, session, script, stats, think_time=0.0):
+        self.host = host
+        self.port = port
+        self.session = session
+        self.pgn, self.commands = script
+        self.stats = stats
+        self.think_time = think_time
+
+    async def rest(self, method, route, payload=None):
+        started = time.perf_counter()
+        status, _ = await http_request(self.host, self.port, method, f"{route}?session={self.session}", payload)
+        self.stats['rest'].setdefault(route, []).append(time.perf_counter() - started)
+        if status >= 500:
+            self.stats['errors'] += 1
+
+    async def run(self, deadline):
+        ws = await WebSocketClient.connect(self.host, self.port, f"/ws?session={self.session}")
+        try:
+            while time.time() < deadline:
+                # REST traffic: load the game, step into it and start over, like the PGN panel does
+                await self.rest('POST', '/pgn', {'pgn': self.pgn})
+                for _ in range(3):
+                    await self.rest('POST', '/navigate_forward')
+                await self.rest('POST', '/reset')
+
+                for command in self.commands:
+                    if time.time() >= deadline or ws.closed:
+                        break
+                    await self.command(ws, command)
+                    if self.think_time:
+                        await asyncio.sleep(self.think_time)
+                if ws.closed:
+                    self.stats['errors'] += 1
+                    break
+        finally:
+            await ws.close()
+
+    async def command(self, ws, command):
+        started = time.time()
+        await ws.send(command)
+        # Replies are queued in order with the broadcasts, so the next FEN or error answers this command
+        while True:
+            received, message = await ws.receive()
+            if message is None:
+                return
+            if 'received_at' in message:
+                self.stats['eval'].append(max(0.0, received - message['received_at']))
+            if 'fen' in message or 'error' in message:
+                self.stats['command'].append(received - started)
+                self.stats['commands'] += 1
+                if 'error' in message:
+                    self.stats['errors'] += 1
+                return
+
+
+async def run_level(host, port, clients, duration, scripts, think_time, level):
+    stats = {'command': [], 'eval': [], 'rest': {}, 'commands': 0, 'errors': 0}
+    deadline = time.time() + duration
+    runners = [LoadClient(host, port, f"load-{level}-{index}", scripts[index % len(scripts)], stats, think_time)
+               for index in range(clients)]
+    started = time.perf_counter()
+    results = await asyncio.gather(*(runner.run(deadline) for runner in runners), return_exceptions=True)
+    elapsed = time.perf_counter() - started
+    for result in results:
+        if isinstance(result, Exception):
+            logger.error(f"Load client failed: {result}")
+            stats['errors'] += 1
+
+    return {
+        'clients': clients,
+        'duration_s': elapsed,
+        'commands': stats['commands'],
+        'commands_per_s': stats['commands'] / elapsed,
+        'errors': stats['errors'],
+        'command_latency': percentiles(stats['command']),
+        'eval_latency': percentiles(stats['eval']),
+        'rest_latency': {route: percentiles(samples) for route, samples in sorted(stats['rest'].items())},
+    }
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+async def wait_for_server(host, port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            _, writer = await asyncio.open_connection(host, port)
+            writer.close()
+            return
+        except OSError:
+            await asyncio.sleep(0.2)
+    raise TimeoutError(f"Server on {host}:{port} did not come up within {timeout}s")
+
+
+def start_server(port, engine_delay):
+    # The real app under hypercorn, with the deterministic fake engine standing in for Stockfish
+    env = dict(os.environ, SHIRO_ENGINE=f"{sys.executable} {FAKE_ENGINE} --delay {engine_delay}")
+    return subprocess.Popen([sys.executable, '-m', 'hypercorn', 'app:app', '--bind', f'127.0.0.1:{port}'],
+                            cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def print_curve(levels):
+    # Latencies in milliseconds
+    print(f"{'clients':>8} {'cmd/s':>9} {'cmd p50':>9} {'cmd p95':>9} {'cmd p99':>9} "
+          f"{'eval p50':>9} {'eval p95':>9} {'eval p99':>9} {'errors':>7}", file=sys.stderr)
+
+    def ms(value):
+        return f"{value:9.1f}" if value is not None else f"{'-':>9}"
+
+    for level in levels:
+        command, evaluation = level['command_latency'], level['eval_latency']
+        print(f"{level['clients']:>8} {level['commands_per_s']:>9.1f} {ms(command['p50_ms'])} {ms(command['p95_ms'])} "
+              f"{ms(command['p99_ms'])} {ms(evaluation['p50_ms'])} {ms(evaluation['p95_ms'])} "
+              f"{ms(evaluation['p99_ms'])} {level['errors']:>7}", file=sys.stderr)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Replay scripted GUI traffic against the server and report "
+                                                 "latency percentiles and throughput per client count")
+    parser.add_argument('--url', default=None, help="existing server to test (default: start one with the fake engine)")
+    parser.add_argument('--clients', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32, 64])
+    parser.add_argument('--duration', type=float, default=10, help="seconds per client count")
+    parser.add_argument('--think-time', type=float, default=0.0, help="seconds each client waits between commands")
+    parser.add_argument('--engine-delay', type=int, default=10, help="fake engine milliseconds per depth")
+    parser.add_argument('--output', default=None, help="write results to this JSON file (default: stdout)")
+    args = parser.parse_args()
+
+    server = None
+    if args.url:
+        url = urlsplit(args.url)
+        host, port = url.hostname, url.port or 80
+    else:
+        host, port = '127.0.0.1', free_port()
+        server = start_server(port, args.engine_delay)
+    try:
+        await wait_for_server(host, port)
+        scripts = load_scripts()
+        levels = []
+        for clients in args.clients:
+            logger.info(f"Running {clients} clients for {args.duration}s")
+            levels.append(await run_level(host, port, clients, args.duration, scripts, args.think_time, len(levels)))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    print_curve(levels)
+    report = {
+        'revision': git_revision(),
+        'server': args.url or f"local, fake engine at {args.engine_delay}ms per depth",
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'levels': levels,
+    }
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(report, output_file, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main())
@@ -0,0 +1,180 @@
+import math
+import time
+import bisect
+import contextlib
+
+# Prometheus text exposition without the client library. Recording is a few additions on the hot path;
+# everything else, gauges included, is only computed when /metrics is scraped.
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in labels.values())
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + '}'
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.children = {}  # Maps label values to the child holding that series
+
+    def labels(self, *values):
+        child = self.children.get(values)
+        if child is None:
+            child = self.children[values] = self._child()
+        return child
+
+    def samples(self):
+        if not self.labelnames:
+            yield from self._samples(self.labels(), {})
+            return
+        for values, child in list(self.children.items()):
+            yield from self._samples(child, dict(zip(self.labelnames, values)))
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        lines.extend(f"{name}{format_labels(labels)} {format_value(value)}" for name, labels, value in self.samples())
+        return '\n'.join(lines)
+
+
+class CounterValue:
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def _child(self):
+        return CounterValue()
+
+    def inc(self, amount=1):
+        self.labels().value += amount
+
+    def _samples(self, child, labels):
+        yield f"{self.name}_total", labels, child.value
+
+
+class Gauge(Metric):
+    # Read through a function at scrape time, so keeping it current costs nothing
+    type = 'gauge'
+
+    def __init__(self, name, documentation, function):
+        super().__init__(name, documentation)
+        self.function = function
+
+    def samples(self):
+        yield self.name, {}, self.function()
+
+
+class HistogramValue:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)  # Per bucket here; made cumulative when rendered
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.counts):
+            self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+    @contextlib.contextmanager
+    def time(self):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started)
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def _child(self):
+        return HistogramValue(self.buckets)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def time(self):
+        return self.labels().time()
+
+    def _samples(self, child, labels):
+        cumulative = 0
+        for bound, count in zip(self.buckets, child.counts):
+            cumulative += count
+            yield f"{self.name}_bucket", {**labels, 'le': format_value(float(bound))}, cumulative
+        yield f"{self.name}_bucket", {**labels, 'le': '+Inf'}, child.count
+        yield f"{self.name}_sum", labels, child.sum
+        yield f"{self.name}_count", labels, child.count
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+
+    def register(self, metric):
+        if metric.name in self.metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def gauge(self, name, documentation, function):
+        # Replaces an earlier gauge of the same name, e.g. when the app re-binds it to new state
+        metric = Gauge(name, documentation, function)
+        self.metrics[name] = metric
+        return metric
+
+    def render(self):
+        return '\n'.join(metric.render() for metric in self.metrics.values()) + '\n'
+
+
+registry = Registry()
+
+engine_searches_started = registry.counter(
+    'shiro_engine_searches_started', "Background engine searches started")
+engine_searches_cancelled = registry.counter(
+    'shiro_engine_searches_cancelled', "Background engine searches cancelled before they finished")
+engine_nps = registry.histogram(
+    'shiro_engine_nps', "Engine nodes per second at the end of each background search",
+    buckets=(1e4, 1e5, 2.5e5, 5e5, 1e6, 2.5e6, 5e6, 1e7, 2.5e7, 5e7, 1e8))
+time_to_first_eval = registry.histogram(
+    'shiro_time_to_first_eval_seconds', "From requesting a background search to its first eval reaching the client")
+callback_seconds = registry.histogram(
+    'shiro_callback_seconds', "Time spent in server callbacks", ['callback'])
+tree_serialization_seconds = registry.histogram(
+    'shiro_tree_serialization_seconds', "Time to build a full game tree snapshot")
+pgn_parse_seconds = registry.histogram(
+    'shiro_pgn_parse_seconds', "Time to parse a PGN and load it as the current game")
@@ -0,0 +1,201 @@
+import sys
+import json
+import logging
+import argparse
+import numpy as np
+import chess
+import chess.pgn
+
+logger = logging.getLogger(__name__)
+
+BOOK, BEST, GOOD, INACCURACY, MISTAKE, BLUNDER, UNKNOWN = range(7)
+LABELS = ('book', 'best', 'good', 'inaccuracy', 'mistake', 'blunder', 'unknown')
+NAGS = {INACCURACY: chess.pgn.NAG_DUBIOUS_MOVE, MISTAKE: chess.pgn.NAG_MISTAKE, BLUNDER: chess.pgn.NAG_BLUNDER}
+
+WIN_SLOPE = 0.00368208  # Fitted on rated games: centipawns to expected score
+MATE_CP = 1000  # Mates and anything beyond are treated as this many centipawns
+
+
+def win_percent(cp):
+    return 50 + 50 * (2 / (1 + np.exp(-WIN_SLOPE * cp)) - 1)
+
+
+def move_accuracy(win_loss):
+    return np.clip(103.1668 * np.exp(-0.04354 * win_loss) - 3.1669, 0, 100)
+
+
+def review_to_centipawns(analysis_results, key='score'):
+    # game_review() output: White's score after each move, None for book moves
+    return np.array([np.nan if result.get(key) is None else result[key].score(mate_score=100000)
+                     for result in analysis_results], dtype=np.float64)
+
+
+def review_entry(analysis_results):
+    # White's score before the first move out of book, which game_review() stores on that move as 'before'
+    return review_to_centipawns(analysis_results, key='before')
+
+
+def review_book(analysis_results):
+    return np.array([bool(result.get('book')) for result in analysis_results], dtype=bool)
+
+
+def records_to_centipawns(record):
+    # batch_review records: {'cp', 'mate'} from White's view per ply; book and failed plies are unknown
+    cp = np.array([evaluation.get('cp') for evaluation in record['evals']], dtype=np.float64)
+    mate = np.array([evaluation.get('mate') for evaluation in record['evals']], dtype=np.float64)
+    # Mate 0 means the side to move is mated, i.e. the player who just moved delivered it
+    mover = np.where(np.arange(len(mate)) % 2 == 0, 1.0, -1.0)
+    mate_cp = np.where(mate == 0, mover, np.sign(mate)) * 100000
+    return np.where(np.isnan(mate), cp, mate_cp)
+
+
+def records_entry(record):
+    # batch_review stores the score before the first move out of book on that move as 'before'
+    before = [evaluation.get('before') or {} for evaluation in record['evals']]
+    cp = np.array([evaluation.get('cp') for evaluation in before], dtype=np.float64)
+    mate = np.array([evaluation.get('mate') for evaluation in before], dtype=np.float64)
+    return np.where(np.isnan(mate), cp, np.sign(mate) * 100000)
+
+
+def records_book(record):
+    return np.array([bool(evaluation.get('book')) for evaluation in record['evals']], dtype=bool)
+
+
+class MoveClassifier:
+    def __init__(self, best=1.0, inaccuracy=5.0, mistake=10.0, blunder=15.0):
+        # Thresholds are losses in win percentage for the player who moved
+        self.best = best
+        self.inaccuracy = inaccuracy
+        self.mistake = mistake
+        self.blunder = blunder
+
+    def classify_batch(self, cp, lengths, white_first=None, entry=None, book=None):
+        # cp: White's score after every move of every game, concatenated; NaN where unknown.
+        # entry: White's score before a move where it is not the previous move's, e.g. the first move
+        # out of book or of the game; book: plies the review marked as book
+        cp = np.clip(np.asarray(cp, dtype=np.float64), -MATE_CP, MATE_CP)
+        lengths = np.asarray(lengths, dtype=np.int64)
+        starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+        game = np.repeat(np.arange(len(lengths)), lengths)
+        ply = np.arange(len(cp)) - starts[game]
+
+        # The score before a move is the score after the previous one, unless the review measured it
+        before = np.empty_like(cp)
+        before[1:] = cp[:-1]
+        before[starts[lengths > 0]] = np.nan
+        if entry is not None:
+            entry = np.clip(np.asarray(entry, dtype=np.float64), -MATE_CP, MATE_CP)
+            before = np.where(np.isnan(entry), before, entry)
+        book = np.zeros(len(cp), dtype=bool) if book is None else np.asarray(book, dtype=bool)
+
+        white_first = np.ones(len(lengths), dtype=bool) if white_first is None else np.asarray(white_first)
+        white_moved = (ply % 2 == 0) == white_first[game]
+        sign = np.where(white_moved, 1.0, -1.0)
+
+        with np.errstate(invalid='ignore'):
+            cp_loss = np.maximum(0, sign * (before - cp))
+            win_loss = np.maximum(0, win_percent(sign * before) - win_percent(sign * cp))
+            accuracy = move_accuracy(win_loss)
+
+            # Unknown: no eval before or after a move that was not book, e.g. a failed search
+            classification = np.full(len(cp), UNKNOWN, dtype=np.int8)
+            classification[win_loss >= 0] = GOOD
+            classification[win_loss < self.best] = BEST
+            classification[win_loss >= self.inaccuracy] = INACCURACY
+            classification[win_loss >= self.mistake] = MISTAKE
+            classification[win_loss >= self.blunder] = BLUNDER
+            classification[book] = BOOK
+
+        cp_loss[book] = np.nan  # Book moves never count towards ACPL or accuracy
+
+        # Per game and player: slot 2 * game for White, 2 * game + 1 for Black
+        known = ~np.isnan(cp_loss)
+        slot = 2 * game + (~white_moved)
+        slots = 2 * len(lengths)
+        moves = np.bincount(slot[known], minlength=slots)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            acpl = np.bincount(slot[known], weights=cp_loss[known], minlength=slots) / moves
+            mean_accuracy = np.bincount(slot[known], weights=accuracy[known], minlength=slots) / moves
+        counts = np.zeros((slots, len(LABELS)), dtype=np.int64)
+        np.add.at(counts, (slot, classification), 1)
+
+        return {
+            'before': before,
+            'cp_loss': cp_loss,
+            'win_loss': win_loss,
+            'accuracy': accuracy,
+            'classification': classification,
+            'acpl': acpl.reshape(-1, 2),
+            'game_accuracy': mean_accuracy.reshape(-1, 2),
+            'counts': counts.reshape(-1, 2, len(LABELS)),
+        }
+
+    @staticmethod
+    def summary(result, index=0):
+        summary = {}
+        for color, side in enumerate(('white', 'black')):
+            acpl = result['acpl'][index, color]
+            accuracy = result['game_accuracy'][index, color]
+            summary[side] = {
+                'acpl': None if np.isnan(acpl) else round(float(acpl), 1),
+                'accuracy': None if np.isnan(accuracy) else round(float(accuracy), 1),
+                **{LABELS[code]: int(count) for code, count in enumerate(result['counts'][index, color])},
+            }
+        return summary
+
+    @staticmethod
+    def annotations(result, cp, offset=0, length=None):
+        # Yields (ply, nags, comment) for the plies worth annotating
+        classification = result['classification']
+        length = len(classification) - offset if length is None else length
+        window = classification[offset:offset + length]
+        flagged = offset + np.flatnonzero((window >= INACCURACY) & (window <= BLUNDER))
+        pawns = np.clip(cp, -MATE_CP, MATE_CP) / 100
+        for index in flagged:
+            code = int(classification[index])
+            before = result['before'][index] / 100
+            after = pawns[index]
+            comment = f"{LABELS[code].capitalize()} ({before:+.2f} → {after:+.2f})"
+            yield int(index - offset), [NAGS[code]], comment
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Classify the moves of games reviewed by batch_review.py")
+    parser.add_argument('review', help="JSON lines written by batch_review.py")
+    parser.add_argument('--output', default=None, help="per-game summaries as JSON lines (default: stdout)")
+    args = parser.parse_args()
+
+    with open(args.review) as review_file:
+        records = [json.loads(line) for line in review_file]
+    records = [record for record in records if 'evals' in record]
+
+    # One flat array for the whole batch, so classification is a handful of NumPy passes
+    def concatenate(arrays):
+        return np.concatenate(arrays) if arrays else np.empty(0)
+
+    cp = concatenate([records_to_centipawns(record) for record in records])
+    entry = concatenate([records_entry(record) for record in records])
+    book = concatenate([records_book(record) for record in records]).astype(bool)
+    result = MoveClassifier().classify_batch(cp, [len(record['evals']) for record in records], entry=entry, book=book)
+
+    output_file = open(args.output, 'w') if args.output else sys.stdout
+    try:
+        offset = 0
+        for index, record in enumerate(records):
+            length = len(record['evals'])
+            summary = {
+                'index': record['index'],
+                **MoveClassifier.summary(result, index),
+                'moves': [LABELS[code] for code in result['classification'][offset:offset + length]],
+            }
+            output_file.write(json.dumps(summary) + '\n')
+            offset += length
+    finally:
+        if output_file is not sys.stdout:
+            output_file.close()
+    logger.info(f"Classified {len(cp)} moves from {len(records)} games")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,79 @@
+import os
+import glob
+import logging
+import threading
+import chess
+import chess.polyglot
+
+logger = logging.getLogger(__name__)
+
+
+class PolyglotBook:
+    def __init__(self, paths):
+        self.readers = {}  # Maps book file name to its memory-mapped reader
+        for path in paths:
+            try:
+                # MemoryMappedReader maps the file and binary-searches entries by Zobrist key
+                self.readers[os.path.basename(path)] = chess.polyglot.open_reader(path)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Skipping polyglot book {path}: {e}")
+
+    @classmethod
+    def from_directory(cls, directory='book/polyglot-collection'):
+        return cls(sorted(glob.glob(os.path.join(directory, '*.bin'))))
+
+    def contains(self, board):
+        for reader in self.readers.values():
+            if reader.get(board) is not None:
+                return True
+        return False
+
+    def probe(self, board, minimum_weight=1):
+        # Books weight on different scales, so each book's weights are normalised to shares first
+        moves = {}
+        books = 0
+        for name, reader in self.readers.items():
+            entries = list(reader.find_all(board, minimum_weight=minimum_weight))
+            total = sum(entry.weight for entry in entries)
+            if not total:
+                continue
+            books += 1
+            for entry in entries:
+                merged = moves.setdefault(entry.move, {'weight': 0, 'share': 0.0, 'books': []})
+                merged['weight'] += entry.weight
+                merged['share'] += entry.weight / total
+                merged['books'].append(name)
+
+        book_moves = [
+            {
+                'move': move.uci(),
+                'san': board.san(move),
+                'weight': merged['weight'],
+                'share': merged['share'] / books,
+                'books': merged['books'],
+            }
+            for move, merged in moves.items()
+        ]
+        book_moves.sort(key=lambda book_move: book_move['share'], reverse=True)
+        return book_moves
+
+    def close(self):
+        for reader in self.readers.values():
+            reader.close()
+        self.readers.clear()
+
+
+_shared_books = {}
+_shared_lock = threading.Lock()
+
+
+def get_polyglot_book(directory='book/polyglot-collection'):
+    # Opened once per process on first use and shared by every GameBoard
+    book = _shared_books.get(directory)
+    if book is None:
+        with _shared_lock:
+            book = _shared_books.get(directory)
+            if book is None:
+                book = PolyglotBook.from_directory(directory)
+                _shared_books[directory] = book
+    return book
@@ -0,0 +1,387 @@
+import os
+import sqlite3
+import logging
+import argparse
+import threading
+import chess
+import chess.pgn
+import chess.polyglot
+from tree_store import encode_move, decode_move
+
+logger = logging.getLogger(__name__)
+
+# Explorer aggregates per (position, next move), kept up to date while indexing; move 0 = game ended
+MOVE_STATS_TABLE = """
+    CREATE TABLE move_stats (
+        key INTEGER NOT NULL,
+        move INTEGER NOT NULL,
+        games INTEGER NOT NULL,
+        white INTEGER NOT NULL,
+        draws INTEGER NOT NULL,
+        black INTEGER NOT NULL,
+        rating_sum INTEGER NOT NULL,
+        rated INTEGER NOT NULL,
+        best_game INTEGER,
+        best_rating INTEGER,
+        PRIMARY KEY (key, move)
+    ) WITHOUT ROWID
+"""
+
+# Example games per position, best rated first; the LIMIT of a search stops after the rows it returns
+RATING_INDEX = "CREATE INDEX IF NOT EXISTS positions_by_rating ON positions (key, rating DESC, move)"
+
+
+def db_key(board):
+    # SQLite integers are signed 64-bit
+    key = chess.polyglot.zobrist_hash(board)
+    return key - (1 << 64) if key >= (1 << 63) else key
+
+
+def parse_elo(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class PositionIndex:
+    def __init__(self, db_path='games.sqlite', max_ply=None, commit_every=500):
+        self.db_path = db_path
+        self.max_ply = max_ply  # Deepest ply indexed per game, None for whole games
+        self.commit_every = commit_every  # Games per transaction while indexing
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(db_path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS sources (
+                path TEXT PRIMARY KEY,
+                offset INTEGER NOT NULL,
+                games INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS games (
+                id INTEGER PRIMARY KEY,
+                source TEXT NOT NULL,
+                offset INTEGER NOT NULL,
+                white TEXT, black TEXT,
+                white_elo INTEGER, black_elo INTEGER,
+                result TEXT, date TEXT, event TEXT
+            );
+            -- Clustered on the Zobrist key, so all games through a position are one range read
+            CREATE TABLE IF NOT EXISTS positions (
+                key INTEGER NOT NULL,
+                game INTEGER NOT NULL,
+                ply INTEGER NOT NULL,
+                move INTEGER,
+                rating INTEGER NOT NULL DEFAULT 0,  -- games.white_elo + games.black_elo, for the example games
+                PRIMARY KEY (key, game, ply)
+            ) WITHOUT ROWID;
+        """)
+        # move_stats only exists once it covers every indexed game. An index built before the explorer
+        # existed needs a full GROUP BY to backfill it; that is left to the indexing CLI instead of
+        # whichever request happens to open the index first
+        stats_exist = self.db.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'move_stats'").fetchone() is not None
+        if not stats_exist and self.db.execute("SELECT 1 FROM positions LIMIT 1").fetchone() is None:
+            self.db.execute(MOVE_STATS_TABLE)
+            stats_exist = True
+        self.db.commit()
+        self.stats_missing = not stats_exist
+        if self.stats_missing:
+            logger.warning(f"{db_path} has no explorer statistics yet; run position_index.py --rebuild-stats")
+        # Same for the rating column of an index built before example games were ranked by it
+        columns = [row[1] for row in self.db.execute("PRAGMA table_info(positions)")]
+        self.ratings_missing = 'rating' not in columns
+        if self.ratings_missing and self.db.execute("SELECT 1 FROM positions LIMIT 1").fetchone() is None:
+            self.add_ratings()
+        elif self.ratings_missing:
+            logger.warning(f"{db_path} does not rank example games yet; run position_index.py --rebuild-stats")
+        else:
+            self.db.execute(RATING_INDEX)
+            self.db.commit()
+
+        self.readers = threading.local()  # One read connection per thread; WAL lets them run beside the writer
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+    def _positions(self, game_id, game, rating):
+        board = game.board()
+        moves = list(game.mainline_moves())
+        ended = self.max_ply is None or len(moves) <= self.max_ply
+        for ply, move in enumerate(moves[:self.max_ply]):
+            yield db_key(board), game_id, ply, encode_move(move), rating
+            board.push(move)
+        if ended:
+            # The final position has no continuation but can still be searched for
+            yield db_key(board), game_id, len(moves), None, rating
+
+    def _add_game(self, source, offset, game):
+        headers = game.headers
+        cursor = self.db.execute(
+            "INSERT INTO games (source, offset, white, black, white_elo, black_elo, result, date, event) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (source, offset, headers.get('White'), headers.get('Black'), parse_elo(headers.get('WhiteElo')),
+             parse_elo(headers.get('BlackElo')), headers.get('Result'), headers.get('Date'), headers.get('Event')))
+        game_id = cursor.lastrowid
+        elos = [elo for elo in (parse_elo(headers.get('WhiteElo')), parse_elo(headers.get('BlackElo'))) if elo]
+        positions = list(self._positions(game_id, game, sum(elos)))
+        self.db.executemany("INSERT OR IGNORE INTO positions VALUES (?, ?, ?, ?, ?)", positions)
+
+        result = headers.get('Result')
+        rating = sum(elos) // len(elos) if elos else None
+        outcome = (result == '1-0', result == '1/2-1/2', result == '0-1')
+        # A position repeated within one game still counts the game once per continuation
+        continuations = {(key, move or 0) for key, _, _, move, _ in positions}
+        self.db.executemany("""
+            INSERT INTO move_stats VALUES (?, ?, 1, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(key, move) DO UPDATE SET
+                games = games + 1,
+                white = white + excluded.white,
+                draws = draws + excluded.draws,
+                black = black + excluded.black,
+                rating_sum = rating_sum + excluded.rating_sum,
+                rated = rated + excluded.rated,
+                -- Strictly higher only: on a tie the earlier game, with the lower id, stays best as in rebuild_stats
+                best_game = CASE WHEN COALESCE(excluded.best_rating, -1) > COALESCE(best_rating, -1)
+                                 THEN excluded.best_game ELSE best_game END,
+                best_rating = NULLIF(MAX(COALESCE(best_rating, -1), COALESCE(excluded.best_rating, -1)), -1)
+        """, [(key, move, *outcome, rating or 0, rating is not None, game_id, rating)
+              for key, move in continuations])
+        return game_id
+
+    def rebuild_stats(self):
+        # Recomputes the explorer table from the raw positions, e.g. for an index built before it existed
+        with self.lock:
+            # One transaction, so the table never exists half filled
+            self.db.commit()
+            self.db.execute("BEGIN")
+            self.db.execute("DROP TABLE IF EXISTS move_stats")
+            self.db.execute(MOVE_STATS_TABLE)
+            # Same aggregate as the incremental upsert in _add_game: each game counted once per continuation,
+            # rated by its players' average Elo (ignoring missing or zero ratings), best_game the highest rated
+            # game with ties going to the lowest id, which is the one indexed first
+            self.db.execute("""
+                INSERT INTO move_stats
+                SELECT key, move, COUNT(*), SUM(result = '1-0'), SUM(result = '1/2-1/2'), SUM(result = '0-1'),
+                       SUM(COALESCE(rating, 0)), SUM(rating IS NOT NULL),
+                       MAX(CASE WHEN rank = 1 THEN game END), MAX(rating)
+                FROM (
+                    SELECT *, ROW_NUMBER() OVER (PARTITION BY key, move ORDER BY COALESCE(rating, -1) DESC, game)
+                              AS rank
+                    FROM (
+                        SELECT DISTINCT positions.key, COALESCE(positions.move, 0) AS move, games.id AS game,
+                               games.result,
+                               (COALESCE(NULLIF(games.white_elo, 0), NULLIF(games.black_elo, 0)) +
+                                COALESCE(NULLIF(games.black_elo, 0), NULLIF(games.white_elo, 0))) / 2 AS rating
+                        FROM positions JOIN games ON games.id = positions.game
+                    )
+                )
+                GROUP BY key, move
+            """)
+            self.db.commit()
+        self.stats_missing = False
+
+    def add_ratings(self):
+        # Adds and fills the rating column of an index built before it existed, in one transaction
+        with self.lock:
+            self.db.commit()
+            self.db.execute("BEGIN")
+            self.db.execute("ALTER TABLE positions ADD COLUMN rating INTEGER NOT NULL DEFAULT 0")
+            self.db.execute("""
+                UPDATE positions SET rating = (
+                    SELECT COALESCE(white_elo, 0) + COALESCE(black_elo, 0) FROM games WHERE games.id = positions.game
+                )
+            """)
+            self.db.execute(RATING_INDEX)
+            self.db.commit()
+        self.ratings_missing = False
+
+    def index_file(self, path):
+        # Incremental: a file that only grew is indexed from where the last run stopped
+        source = os.path.abspath(path)
+        size = os.path.getsize(path)
+        row = self.db.execute("SELECT offset, games FROM sources WHERE path = ?", (source,)).fetchone()
+        offset, indexed = row if row else (0, 0)
+        if offset > size:
+            logger.warning(f"{path} shrank since it was indexed; skipping it")
+            return 0
+
+        added = 0
+        with open(path, 'r', encoding='utf-8', errors='replace') as pgn_file:
+            pgn_file.seek(offset)
+            while True:
+                start = pgn_file.tell()
+                game = chess.pgn.read_game(pgn_file)
+                if game is None:
+                    break
+                with self.lock:
+                    self._add_game(source, start, game)
+                added += 1
+                if added % self.commit_every == 0:
+                    self._commit_source(source, pgn_file.tell(), indexed + added)
+
+            self._commit_source(source, pgn_file.tell(), indexed + added)
+        logger.info(f"Indexed {added} new games from {path}")
+        return added
+
+    def _commit_source(self, source, offset, games):
+        # The resume point is committed with the games it covers, so a crash never double-indexes
+        with self.lock:
+            self.db.execute("INSERT INTO sources VALUES (?, ?, ?) "
+                            "ON CONFLICT(path) DO UPDATE SET offset = excluded.offset, games = excluded.games",
+                            (source, offset, games))
+            self.db.commit()
+
+    def _reader(self):
+        # Read-only connection for the calling thread, so lookups never wait on the indexer's lock
+        reader = getattr(self.readers, 'db', None)
+        if reader is None:
+            reader = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True)
+            self.readers.db = reader
+        return reader
+
+    def _move_stats(self, reader, board, key):
+        if self.stats_missing:
+            return []
+        rows = reader.execute(
+            "SELECT move, games, white, draws, black, rating_sum, rated, best_game FROM move_stats WHERE key = ?",
+            (key,)).fetchall()
+        moves = []
+        for code, games, white, draws, black, rating_sum, rated, best_game in sorted(rows, key=lambda row: -row[1]):
+            move = decode_move(code)
+            moves.append({
+                'move': move.uci() if code else None,  # None: games that ended in this position
+                'san': board.san(move) if code and board.is_legal(move) else None,
+                'games': games,
+                'white': white,
+                'draws': draws,
+                'black': black,
+                'average_rating': rating_sum // rated if rated else None,
+                'best_game': best_game,
+            })
+        return moves
+
+    @staticmethod
+    def _game_payload(row):
+        game_id, white, black, white_elo, black_elo, result, date, event = row
+        return {
+            'id': game_id,
+            'white': white,
+            'black': black,
+            'white_elo': white_elo,
+            'black_elo': black_elo,
+            'result': result,
+            'date': date,
+            'event': event,
+        }
+
+    def search(self, board, limit=20):
+        # Which games reached this position, how they ended and how play continued
+        key = db_key(board)
+        reader = self._reader()
+        if self.ratings_missing:
+            games = []
+        else:
+            # Walks the rating index from the top, so only the returned rows are read
+            games = reader.execute("""
+                SELECT games.id, positions.ply, positions.move, games.white, games.black,
+                       games.white_elo, games.black_elo, games.result, games.date, games.event
+                FROM positions INDEXED BY positions_by_rating JOIN games ON games.id = positions.game
+                WHERE positions.key = ?
+                ORDER BY positions.rating DESC
+                LIMIT ?
+            """, (key, limit)).fetchall()
+
+        moves = self._move_stats(reader, board, key)
+        return {
+            'games': sum(move['games'] for move in moves),
+            'moves': [move for move in moves if move['move'] is not None],
+            'examples': [{
+                **self._game_payload((game_id, *details)),
+                'ply': ply,
+                'move': decode_move(code).uci() if code is not None else None,
+            } for game_id, ply, code, *details in games],
+        }
+
+    def explore(self, board, top_games=8):
+        # One keyed read of the aggregate table, plus primary-key lookups for the example games
+        key = db_key(board)
+        reader = self._reader()
+        moves = self._move_stats(reader, board, key)
+        total = sum(move['games'] for move in moves)
+
+        white_to_move = board.turn == chess.WHITE
+        for move in moves:
+            games = move['games']
+            move['white_percent'] = round(100 * move['white'] / games, 1)
+            move['draw_percent'] = round(100 * move['draws'] / games, 1)
+            move['black_percent'] = round(100 * move['black'] / games, 1)
+            # Score for the side making the move
+            wins = move['white'] if white_to_move else move['black']
+            move['score'] = round(100 * (wins + move['draws'] / 2) / games, 1)
+
+        best = sorted({move['best_game'] for move in moves if move['best_game'] is not None})
+        top = []
+        if best:
+            rows = reader.execute(
+                "SELECT id, white, black, white_elo, black_elo, result, date, event FROM games "
+                f"WHERE id IN ({','.join('?' * len(best))})", best).fetchall()
+            top = sorted((self._game_payload(row) for row in rows),
+                         key=lambda game: -((game['white_elo'] or 0) + (game['black_elo'] or 0)))[:top_games]
+
+        return {
+            'games': total,
+            'moves': [move for move in moves if move['move'] is not None],
+            'top_games': top,
+        }
+
+    def load_game(self, game_id):
+        row = self._reader().execute("SELECT source, offset FROM games WHERE id = ?", (game_id,)).fetchone()
+        if row is None:
+            return None
+        source, offset = row
+        with open(source, 'r', encoding='utf-8', errors='replace') as pgn_file:
+            pgn_file.seek(offset)
+            return chess.pgn.read_game(pgn_file)
+
+
+_shared_index = None
+_shared_lock = threading.Lock()
+
+
+def get_position_index(db_path='games.sqlite'):
+    global _shared_index
+    if _shared_index is None:
+        with _shared_lock:
+            if _shared_index is None:
+                _shared_index = PositionIndex(db_path)
+    return _shared_index
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Add PGN files to the position index")
+    parser.add_argument('pgn', nargs='*')
+    parser.add_argument('--db', default='games.sqlite')
+    parser.add_argument('--max-ply', type=int, default=None, help="index only the first plies of each game")
+    parser.add_argument('--rebuild-stats', action='store_true', help="recompute the explorer statistics")
+    args = parser.parse_args()
+
+    index = PositionIndex(args.db, max_ply=args.max_ply)
+    try:
+        if index.ratings_missing:
+            logger.info(f"Ranking example games in {args.db}")
+            index.add_ratings()
+        if index.stats_missing or args.rebuild_stats:
+            # Backfilled before new games are added, which then keep the table current themselves
+            logger.info(f"Rebuilding explorer statistics in {args.db}")
+            index.rebuild_stats()
+        for path in args.pgn:
+            index.index_file(path)
+    finally:
+        index.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,95 @@
+import sys
+import json
+import time
+import asyncio
+import logging
+import argparse
+import chess
+import chess.engine
+import chess.pgn
+from sequential_review import SequentialReview
+
+logger = logging.getLogger(__name__)
+
+
+def load_games(path):
+    games = []
+    with open(path) as pgn_file:
+        while (game := chess.pgn.read_game(pgn_file)) is not None:
+            games.append(game)
+    return games
+
+
+async def review_independent(engine, game, limit):
+    # Every ply as its own search, the way game_review and the pool search them today: no game token,
+    # so the engine keeps its hash between plies and no ucinewgame is sent
+    infos = []
+    board = game.board()
+    for move in game.mainline_moves():
+        board.push(move)
+        infos.append(await engine.analyse(board, limit))
+    return infos
+
+
+async def run_mode(engine_path, games, mode, limit, hash_mb):
+    transport, engine = await chess.engine.popen_uci(engine_path)
+    try:
+        options = {'Hash': hash_mb, 'Threads': 1}
+        await engine.configure({name: value for name, value in options.items() if name in engine.options})
+
+        started = time.perf_counter()
+        if mode == 'independent':
+            nodes = searches = 0
+            for game in games:
+                infos = await review_independent(engine, game, limit)
+                nodes += sum(info.get('nodes') or 0 for info in infos)
+                searches += len(infos)
+        else:
+            review = SequentialReview(mode)
+            for game in games:
+                await review.review_game(engine, game, limit)
+            nodes, searches = review.nodes, review.searches
+        seconds = time.perf_counter() - started
+    finally:
+        await engine.quit()
+
+    return {'mode': mode, 'games': len(games), 'searches': searches, 'nodes': nodes, 'seconds': round(seconds, 3)}
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Compare nodes and wall time of the game review orders")
+    parser.add_argument('--pgn', default='benchmarks/games.pgn')
+    parser.add_argument('--engine', default='stockfish')
+    parser.add_argument('--depth', type=int, default=16)
+    parser.add_argument('--hash', type=int, default=128, help="hash size in MB")
+    parser.add_argument('--modes', nargs='+', default=['independent', 'forward', 'backward'])
+    parser.add_argument('--output', default=None, help="write the results as JSON")
+    args = parser.parse_args()
+
+    engine_path = args.engine if '/' in args.engine else f"engines/{args.engine}"
+    games = load_games(args.pgn)
+    limit = chess.engine.Limit(depth=args.depth)
+
+    results = []
+    for mode in args.modes:
+        # A fresh engine per mode, so no mode starts with another's hash
+        result = await run_mode(engine_path, games, mode, limit, args.hash)
+        logger.info(f"{mode}: {result['nodes']} nodes in {result['seconds']}s")
+        results.append(result)
+
+    baseline = results[0]
+    for result in results:
+        result['nodes_ratio'] = round(result['nodes'] / baseline['nodes'], 3) if baseline['nodes'] else None
+        result['time_ratio'] = round(result['seconds'] / baseline['seconds'], 3) if baseline['seconds'] else None
+
+    report = {'engine': engine_path, 'depth': args.depth, 'hash_mb': args.hash, 'results': results}
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(report, output_file, indent=2)
+    json.dump(report, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main())
@@ -0,0 +1,48 @@
+import logging
+
+REVIEW_ORDERS = ('backward', 'forward')
+
+
+class SequentialReview:
+    def __init__(self, order='backward', eval_cache=None, engine_key=None):
+        if order not in REVIEW_ORDERS:
+            raise ValueError(f"Unknown review order: {order}")
+        self.logger = logging.getLogger(__name__)
+        self.order = order
+        self.eval_cache = eval_cache
+        self.engine_key = engine_key
+        self.nodes = 0
+        self.searches = 0
+
+    async def review_game(self, engine, game, limit, first_ply=0):
+        # Boards keep their move stack, so python-chess sends "position startpos moves ..." and
+        # the engine sees one growing (or shrinking) line instead of unrelated FENs
+        boards = []
+        board = game.board()
+        for move in game.mainline_moves():
+            board.push(move)
+            boards.append(board.copy())
+
+        # One token per game: ucinewgame (and the hash clear it implies) only happens between games
+        game_token = object()
+        plies = range(first_ply, len(boards))
+        if self.order == 'backward':
+            # Later positions fill the hash with the lines earlier positions are about to search
+            plies = reversed(plies)
+
+        infos = [None] * len(boards)
+        for ply in plies:
+            infos[ply] = await self._analyse(engine, boards[ply], limit, game_token)
+        return infos[first_ply:]
+
+    async def _analyse(self, engine, board, limit, game_token):
+        if self.eval_cache is not None:
+            cached = self.eval_cache.get(board, self.engine_key)
+            if cached is not None and cached['depth'] >= (limit.depth or 0):
+                return cached
+        info = await engine.analyse(board, limit, game=game_token)
+        self.searches += 1
+        self.nodes += info.get('nodes') or 0
+        if self.eval_cache is not None:
+            self.eval_cache.put(board, self.engine_key, info)
+        return info
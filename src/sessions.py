@@ -0,0 +1,116 @@
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from broadcast import Broadcaster
+
+
+class SessionLimitError(Exception):
+    pass
+
+
+class Session:
+    def __init__(self, session_id):
+        self.id = session_id
+        self.board = None
+        self.clients = Broadcaster()  # Websockets currently attached to this session
+        self.last_seen = time.monotonic()
+
+    def touch(self):
+        self.last_seen = time.monotonic()
+
+    def idle_for(self):
+        return time.monotonic() - self.last_seen
+
+    async def attach(self, ws, resync=None):
+        client = self.clients.add(ws, resync=resync)
+        if len(self.clients) == 1:
+            # Engine time only goes to sessions someone is watching, not to ones touched over REST
+            await self.board.start_background_analysis(depth=20)
+        return client
+
+    async def detach(self, ws):
+        self.clients.discard(ws)
+        self.touch()
+        if not self.clients:
+            await self.board.stop_background_analysis()
+
+
+class SessionManager:
+    def __init__(self, board_factory, max_sessions=200, idle_timeout=900):
+        self.logger = logging.getLogger(__name__)
+        self.board_factory = board_factory  # Builds the GameBoard for a new Session
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout  # Seconds without activity or clients before eviction
+        self.sessions = OrderedDict()  # Least recently used first
+        self.creating = {}  # Session id -> task building it, shared by concurrent requests for that id
+        self.eviction_task = None
+
+    def __len__(self):
+        return len(self.sessions)
+
+    async def get(self, session_id):
+        session = self.sessions.get(session_id)
+        if session is not None:
+            self.sessions.move_to_end(session_id)
+            session.touch()
+            return session
+
+        creating = self.creating.get(session_id)
+        if creating is None:
+            creating = self.creating[session_id] = asyncio.ensure_future(self._create(session_id))
+            creating.add_done_callback(lambda _: self.creating.pop(session_id, None))
+        # Shielded, so one caller going away does not cancel the session the others are waiting for
+        return await asyncio.shield(creating)
+
+    async def _create(self, session_id):
+        if len(self.sessions) >= self.max_sessions:
+            await self._evict_one()
+
+        session = Session(session_id)
+        session.board = self.board_factory(session)
+        self.sessions[session_id] = session
+        self.logger.info(f"Started session {session_id} ({len(self.sessions)} live)")
+        return session
+
+    async def _evict_one(self):
+        # Make room by dropping the least recently used session nobody is connected to
+        for session in self.sessions.values():
+            if not session.clients:
+                await self.close(session.id)
+                return
+        raise SessionLimitError(f"All {self.max_sessions} sessions have connected clients")
+
+    async def close(self, session_id):
+        session = self.sessions.pop(session_id, None)
+        if session is None:
+            return
+        session.clients.close()
+        await session.board.stop_background_analysis()
+        await session.board.stop_tree_analysis()
+        await session.board.close_engine()
+        self.logger.info(f"Closed session {session_id} ({len(self.sessions)} live)")
+
+    async def evict_idle(self):
+        expired = [session.id for session in self.sessions.values()
+                   if not session.clients and session.idle_for() > self.idle_timeout]
+        for session_id in expired:
+            await self.close(session_id)
+        return len(expired)
+
+    async def _run_eviction(self, interval):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.evict_idle()
+            except Exception as e:
+                self.logger.error(f"Error evicting idle sessions: {e}")
+
+    def start_eviction(self, interval=60):
+        self.eviction_task = asyncio.create_task(self._run_eviction(interval))
+
+    async def close_all(self):
+        if self.eviction_task:
+            self.eviction_task.cancel()
+        for session_id in list(self.sessions):
+            await self.close(session_id)
@@ -0,0 +1,192 @@
+import os
+import sys
+import time
+import inspect
+import logging
+import functools
+import threading
+import contextvars
+from collections import Counter, deque
+
+logger = logging.getLogger(__name__)
+
+_current_span = contextvars.ContextVar('shiro_span', default=None)
+
+
+class Span:
+    def __init__(self, tracer, name, attributes, parent):
+        self.tracer = tracer
+        self.name = name
+        self.attributes = attributes
+        self.parent = parent
+        self.children = []  # (name, seconds) of finished child spans, to show where a slow span spent its time
+        self.wall_time = time.time()
+        self.started = time.perf_counter()
+        self.duration = None
+
+    def finish(self):
+        self.duration = time.perf_counter() - self.started
+        _current_span.set(self.parent)
+        if self.parent is not None:
+            self.parent.children.append((self.name, self.duration))
+        self.tracer.finished(self)
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'started': self.wall_time,
+            'duration_ms': self.duration * 1000,
+            'attributes': self.attributes,
+            'children': [{'name': name, 'duration_ms': duration * 1000} for name, duration in self.children],
+        }
+
+
+class Tracer:
+    def __init__(self, slow_threshold=0.05, capacity=200):
+        self.slow_threshold = slow_threshold  # Seconds; faster spans are timed but not kept
+        self.slow = deque(maxlen=capacity)  # Most recent slow root spans, oldest dropped first
+        self.enabled = True
+
+    def start(self, name, **attributes):
+        span = Span(self, name, attributes, _current_span.get())
+        _current_span.set(span)
+        return span
+
+    def span(self, name, **attributes):
+        return _SpanContext(self, name, attributes)
+
+    def finished(self, span):
+        # Nested spans show up as children of their slow parent instead of as separate entries.
+        # A task started inside a span inherits it, but outlives it: then it counts as a root again
+        root = span.parent is None or span.parent.duration is not None
+        if root and span.duration >= self.slow_threshold:
+            self.slow.append(span)
+
+    def slow_operations(self, min_ms=0, limit=None):
+        spans = [span.to_dict() for span in reversed(self.slow) if span.duration * 1000 >= min_ms]
+        return spans[:limit] if limit else spans
+
+
+class _SpanContext:
+    def __init__(self, tracer, name, attributes):
+        self.tracer = tracer
+        self.name = name
+        self.attributes = attributes
+        self.span = None
+
+    def __enter__(self):
+        if self.tracer.enabled:
+            self.span = self.tracer.start(self.name, **self.attributes)
+        return self.span
+
+    def __exit__(self, exc_type, exc, traceback):
+        if self.span is not None:
+            if exc_type is not None:
+                self.span.attributes['error'] = exc_type.__name__
+            self.span.finish()
+
+
+_shared_tracer = None
+
+
+def get_tracer():
+    global _shared_tracer
+    if _shared_tracer is None:
+        _shared_tracer = Tracer()
+    return _shared_tracer
+
+
+def traced(name):
+    def decorate(function):
+        if inspect.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def wrapper(*args, **kwargs):
+                with get_tracer().span(name):
+                    return await function(*args, **kwargs)
+        else:
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with get_tracer().span(name):
+                    return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def traced_methods(cls):
+    # Wraps every public method in a span named after the class and method
+    for attribute, value in list(vars(cls).items()):
+        if not attribute.startswith('_') and inspect.isfunction(value):
+            setattr(cls, attribute, traced(f"{cls.__name__}.{attribute}")(value))
+    return cls
+
+
+def frame_label(frame):
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+
+class SamplingProfiler:
+    # Samples every thread's stack from a background thread and writes them in the collapsed-stack
+    # format flamegraph.pl and speedscope read: "thread;outer;...;inner count" per line
+    def __init__(self, output_directory='profiles', interval=0.005):
+        self.output_directory = output_directory
+        self.interval = interval  # Seconds between samples
+        self.thread = None
+        self.last_output = None
+        self.samples = 0
+
+    @property
+    def running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self, seconds):
+        if self.running:
+            return None
+        os.makedirs(self.output_directory, exist_ok=True)
+        path = os.path.join(self.output_directory, f"shiro-{time.strftime('%Y%m%d-%H%M%S')}.collapsed")
+        self.thread = threading.Thread(target=self._run, args=(seconds, path), name='sampling-profiler', daemon=True)
+        self.thread.start()
+        return path
+
+    def _run(self, seconds, path):
+        stacks = Counter()
+        own_id = threading.get_ident()
+        deadline = time.monotonic() + seconds
+        samples = 0
+        try:
+            while time.monotonic() < deadline:
+                names = {thread.ident: thread.name for thread in threading.enumerate()}
+                for thread_id, frame in sys._current_frames().items():
+                    if thread_id == own_id:
+                        continue
+                    stack = []
+                    while frame is not None:
+                        stack.append(frame_label(frame))
+                        frame = frame.f_back
+                    stack.append(names.get(thread_id, str(thread_id)))
+                    stacks[';'.join(reversed(stack))] += 1
+                samples += 1
+                time.sleep(self.interval)
+
+            with open(path, 'w') as output_file:
+                for stack, count in stacks.most_common():
+                    output_file.write(f"{stack} {count}\n")
+            self.samples = samples
+            self.last_output = path
+            logger.info(f"Wrote {samples} profile samples to {path}")
+        except Exception as e:
+            logger.error(f"Error while profiling: {e}")
+
+    def status(self):
+        return {'running': self.running, 'last_output': self.last_output, 'samples': self.samples,
+                'interval_s': self.interval}
+
+
+_shared_profiler = None
+
+
+def get_profiler():
+    global _shared_profiler
+    if _shared_profiler is None:
+        _shared_profiler = SamplingProfiler()
+    return _shared_profiler
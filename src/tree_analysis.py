@@ -0,0 +1,159 @@
+import heapq
+import asyncio
+import logging
+from collections import deque
+import chess
+import chess.polyglot
+
+COLLECT_CHUNK = 50  # Nodes walked between yields to the event loop
+
+class TreeAnalysis:
+    def __init__(self, analyse, on_eval=None, depth=16, workers=1):
+        self.logger = logging.getLogger(__name__)
+        self.analyse = analyse  # Coroutine function (board, depth) -> engine info
+        self.on_eval = on_eval  # Called with the nodes whose [%eval] was just written
+        self.depth = depth
+        self.workers = workers
+        self.game = None
+        self.cursor = None  # Positions closest to this node are analysed first
+        self.pending = {}  # Zobrist key -> (board, nodes): transpositions share one search
+        self.queue = []  # Heap of (distance from the cursor, key) over pending; stale keys are skipped
+        self.cursor_changed = False
+        self.collecting = asyncio.Lock()  # One tree walk at a time, however many workers notice the edit
+        self.in_flight = set()
+        self.dirty = False
+        self.wakeup = asyncio.Event()
+        self.tasks = []
+        self.analysed = 0
+
+    def start(self, game, cursor):
+        self.tree_changed(game, cursor)
+        if not self.tasks:
+            self.tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        self.pending.clear()
+        self.queue = []
+        self.in_flight.clear()
+
+    def tree_changed(self, game, cursor):
+        # Cheap: the walk happens in the workers, and nodes that already carry an eval are skipped
+        self.game = game
+        self.cursor = cursor
+        self.dirty = True
+        self.wakeup.set()
+
+    def cursor_moved(self, cursor):
+        self.cursor = cursor
+        self.cursor_changed = True
+
+    def _needs_eval(self, node):
+        return node.eval() is None or (node.eval_depth() or 0) < self.depth
+
+    async def _collect(self):
+        # Walked in chunks so a large tree never blocks the event loop; an edit during a pause
+        # starts the walk over, since the nodes still on the stack may have been removed
+        while self.dirty:
+            self.dirty = False
+            pending = {}
+            board = self.game.board()
+            stack = [(variation, False) for variation in reversed(self.game.variations)]
+            walked = 0
+            while stack:
+                node, leaving = stack.pop()
+                if leaving:
+                    board.pop()
+                    continue
+                board.push(node.move)
+                stack.append((node, True))
+                stack.extend((variation, False) for variation in reversed(node.variations))
+
+                if self._needs_eval(node):
+                    key = chess.polyglot.zobrist_hash(board)
+                    if key not in self.in_flight:
+                        entry = pending.get(key)
+                        if entry is None:
+                            # Without the move stack: the engine only needs the position
+                            pending[key] = (board.copy(stack=False), [node])
+                        else:
+                            entry[1].append(node)
+
+                walked += 1
+                if walked % COLLECT_CHUNK == 0:
+                    await asyncio.sleep(0)
+                    if self.dirty:
+                        break
+            else:
+                self.pending = pending
+                self._prioritise()
+
+    def _prioritise(self):
+        # One walk from the cursor per collection or cursor move, not per pick
+        self.cursor_changed = False
+        distances = self._distances()
+        unreachable = len(distances) + 1
+        self.queue = [(min(distances.get(node, unreachable) for node in nodes), key)
+                      for key, (_, nodes) in self.pending.items()]
+        heapq.heapify(self.queue)
+
+    def _distances(self):
+        # Tree distance from the cursor, walking both towards the root and into side lines
+        distances = {}
+        queue = deque()
+        if self.cursor is not None:
+            distances[self.cursor] = 0
+            queue.append(self.cursor)
+        while queue:
+            node = queue.popleft()
+            neighbours = list(node.variations)
+            if node.parent is not None:
+                neighbours.append(node.parent)
+            for neighbour in neighbours:
+                if neighbour not in distances:
+                    distances[neighbour] = distances[node] + 1
+                    queue.append(neighbour)
+        return distances
+
+    def _next(self):
+        if self.cursor_changed:
+            self._prioritise()
+        while self.queue:
+            _, key = heapq.heappop(self.queue)
+            entry = self.pending.pop(key, None)
+            if entry is not None:
+                return key, *entry
+        return None
+
+    async def _work(self):
+        while True:
+            if self.dirty:
+                async with self.collecting:
+                    await self._collect()
+            if not self.pending:
+                # Everything is annotated; sleep until the tree changes
+                self.wakeup.clear()
+                await self.wakeup.wait()
+                continue
+
+            picked = self._next()
+            if picked is None:
+                continue
+            key, board, nodes = picked
+            self.in_flight.add(key)
+            try:
+                info = await self.analyse(board, self.depth)
+                for node in nodes:
+                    node.set_eval(info['score'], info.get('depth'))
+                self.analysed += 1
+                if self.on_eval:
+                    self.on_eval(nodes, info)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.logger.error(f"Error analysing tree position {board.fen()}: {e}")
+            finally:
+                self.in_flight.discard(key)
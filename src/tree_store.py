@@ -0,0 +1,297 @@
+import os
+import mmap
+import json
+import functools
+import struct
+import logging
+import numpy as np
+import chess
+import chess.pgn
+import chess.engine
+
+logger = logging.getLogger(__name__)
+
+STORE_MAGIC = b'SHIROTRE'
+STORE_VERSION = 1
+# magic, version, node count, note count, NAG count, string table size, headers size
+HEADER = struct.Struct('=8sIIIIII')
+
+# Nodes in preorder, mainline first: a node's children start right after it and its subtree ends at 'end'
+NODE_DTYPE = np.dtype([
+    ('move', '<u2'),  # from | to << 6 | promotion << 12
+    ('depth', '<u2'),  # Eval depth, NO_DEPTH if none
+    ('parent', '<u4'),
+    ('sibling', '<u4'),  # Next variation of the same parent, NONE if last
+    ('end', '<u4'),  # One past the last node of the subtree
+    ('eval', '<i4'),  # Centipawns from White's view, mates beyond MATE_OFFSET, NO_EVAL if none
+    ('note', '<u4'),  # Row in the notes table, NONE if the node has no comment or NAGs
+])
+# Offsets and sizes into the string table and the NAG array
+NOTE_DTYPE = np.dtype([
+    ('comment', '<u4'), ('comment_size', '<u4'),
+    ('starting', '<u4'), ('starting_size', '<u4'),
+    ('nags', '<u4'), ('nag_count', '<u4'),
+])
+
+NONE = 0xFFFFFFFF
+NO_DEPTH = 0xFFFF
+NO_EVAL = -2 ** 31
+MATE_OFFSET = 1000000000
+
+
+def encode_move(move):
+    return move.from_square | move.to_square << 6 | (move.promotion or 0) << 12
+
+
+def decode_move(code):
+    if not code:
+        return chess.Move.null()
+    return chess.Move(code & 63, code >> 6 & 63, code >> 12 or None)
+
+
+@functools.lru_cache(maxsize=None)
+def uci_name(code):
+    return decode_move(code).uci()
+
+
+def encode_eval(score):
+    if score is None:
+        return NO_EVAL
+    white = score.white()
+    if white.is_mate():
+        mate = white.mate()
+        return MATE_OFFSET + mate if mate > 0 else -MATE_OFFSET + mate
+    return max(-MATE_OFFSET + 1, min(MATE_OFFSET - 1, white.score()))
+
+
+def decode_eval(value):
+    if value == NO_EVAL:
+        return None
+    if value >= MATE_OFFSET:
+        return chess.engine.PovScore(chess.engine.Mate(value - MATE_OFFSET), chess.WHITE)
+    if value <= -MATE_OFFSET:
+        return chess.engine.PovScore(chess.engine.Mate(value + MATE_OFFSET), chess.WHITE)
+    return chess.engine.PovScore(chess.engine.Cp(value), chess.WHITE)
+
+
+class LazyNodeMixin:
+    # Children are materialised from the store the first time anything looks at them
+
+    @property
+    def variations(self):
+        if not self.loaded:
+            self.loaded = True
+            self._variations = []
+            self.store.load_children(self)
+        return self._variations
+
+    @variations.setter
+    def variations(self, variations):
+        self._variations = variations
+
+
+class LazyGame(LazyNodeMixin, chess.pgn.Game):
+    def __init__(self, store, headers=None):
+        self.store = store
+        self.index = 0
+        self.loaded = not store.has_children(0)
+        super().__init__(headers)
+
+
+class LazyChildNode(LazyNodeMixin, chess.pgn.ChildNode):
+    def __init__(self, store, index, parent, move, **kwargs):
+        self.store = store
+        self.index = index
+        self.loaded = not store.has_children(index)
+        super().__init__(parent, move, **kwargs)
+
+
+class TreeStore:
+    def __init__(self, nodes, notes, nags, strings, headers, buffer=None):
+        self.nodes = nodes  # NODE_DTYPE records, usually a view into the mapped file
+        self.notes = notes
+        self.nags = nags
+        self.strings = strings
+        self.headers = headers
+        self.buffer = buffer
+        self.on_load = None  # Called with a node after its children were materialised
+
+    def __len__(self):
+        return len(self.nodes)
+
+    @staticmethod
+    def compile(game):
+        nodes = []
+        notes = []
+        nags = bytearray()
+        strings = bytearray()
+
+        def add_string(text):
+            data = text.encode('utf-8')
+            offset = len(strings)
+            strings.extend(data)
+            return offset, len(data)
+
+        stack = [(game, NONE)]
+        while stack:
+            node, parent = stack.pop()
+            index = len(nodes)
+            # The comment is kept verbatim, [%eval] included, so the PGN round-trips byte for byte;
+            # the node table repeats the eval so snapshots never have to parse comments
+            comment = node.comment
+            note = NONE
+            if comment or node.starting_comment or node.nags:
+                note = len(notes)
+                notes.append((*add_string(comment), *add_string(node.starting_comment),
+                              len(nags), len(node.nags)))
+                nags.extend(sorted(node.nags))
+            depth = node.eval_depth()
+            nodes.append([
+                encode_move(node.move) if node.move else 0,
+                NO_DEPTH if depth is None else depth,
+                parent, NONE, 0, encode_eval(node.eval()), note,
+            ])
+            # Children are pushed last-first so the mainline comes out right after its parent
+            stack.append((None, index))  # Marks where this subtree ends
+            for variation in reversed(node.variations):
+                stack.append((variation, index))
+
+            while stack and stack[-1][0] is None:
+                _, finished = stack.pop()
+                nodes[finished][4] = len(nodes)
+
+        # Siblings: consecutive children of the same parent in preorder
+        last_child = {}
+        for index, record in enumerate(nodes):
+            previous = last_child.get(record[2])
+            if previous is not None:
+                nodes[previous][3] = index
+            last_child[record[2]] = index
+
+        return (
+            np.array([tuple(record) for record in nodes], dtype=NODE_DTYPE),
+            np.array(notes, dtype=NOTE_DTYPE),
+            bytes(nags),
+            bytes(strings),
+            json.dumps(dict(game.headers)).encode('utf-8'),
+        )
+
+    @classmethod
+    def write(cls, game, path):
+        nodes, notes, nags, strings, headers = cls.compile(game)
+        header = HEADER.pack(STORE_MAGIC, STORE_VERSION, len(nodes), len(notes), len(nags),
+                             len(strings), len(headers))
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as store_file:
+            store_file.write(header)
+            store_file.write(nodes.tobytes())
+            store_file.write(notes.tobytes())
+            store_file.write(nags)
+            store_file.write(strings)
+            store_file.write(headers)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def open(cls, path):
+        with open(path, 'rb') as store_file:
+            buffer = mmap.mmap(store_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, node_count, note_count, nag_count, strings_size, headers_size = HEADER.unpack_from(buffer)
+        if (magic, version) != (STORE_MAGIC, STORE_VERSION):
+            buffer.close()
+            raise ValueError(f"{path} is not a game tree store")
+
+        # Views into the mapping: nothing is read until a node is actually visited
+        offset = HEADER.size
+        nodes = np.frombuffer(buffer, dtype=NODE_DTYPE, count=node_count, offset=offset)
+        offset += nodes.nbytes
+        notes = np.frombuffer(buffer, dtype=NOTE_DTYPE, count=note_count, offset=offset)
+        offset += notes.nbytes
+        nags = memoryview(buffer)[offset:offset + nag_count]
+        offset += nag_count
+        strings = memoryview(buffer)[offset:offset + strings_size]
+        offset += strings_size
+        headers = json.loads(bytes(buffer[offset:offset + headers_size]))
+        return cls(nodes, notes, nags, strings, headers, buffer)
+
+    def close(self):
+        self.nodes = self.notes = self.nags = self.strings = None
+        if self.buffer is not None:
+            self.buffer.close()
+            self.buffer = None
+
+    def has_children(self, index):
+        return int(self.nodes[index]['end']) > index + 1
+
+    def children(self, index):
+        if not self.has_children(index):
+            return
+        child = index + 1
+        while child != NONE:
+            yield child
+            child = int(self.nodes[child]['sibling'])
+
+    def _string(self, offset, size):
+        return bytes(self.strings[offset:offset + size]).decode('utf-8')
+
+    def annotation(self, index):
+        note = int(self.nodes[index]['note'])
+        if note == NONE:
+            return '', '', []
+        comment, comment_size, starting, starting_size, nags, nag_count = self.notes[note].tolist()
+        return self._string(comment, comment_size), self._string(starting, starting_size), list(self.nags[nags:nags + nag_count])
+
+    def score(self, index):
+        record = self.nodes[index]
+        depth = int(record['depth'])
+        return decode_eval(int(record['eval'])), None if depth == NO_DEPTH else depth
+
+    def load_children(self, parent):
+        for index in self.children(parent.index):
+            comment, starting_comment, nags = self.annotation(index)
+            LazyChildNode(self, index, parent, decode_move(int(self.nodes[index]['move'])),
+                          comment=comment, starting_comment=starting_comment, nags=nags)
+        if self.on_load is not None:
+            self.on_load(parent)
+
+    def game(self):
+        game = LazyGame(self, self.headers)
+        game.comment, _, _ = self.annotation(0)
+        return game
+
+    def eval_payloads(self, start, end):
+        # The [%eval] of a run of nodes, decoded with a few array operations instead of per node
+        values = self.nodes['eval'][start:end].astype(np.int64)
+        depths = self.nodes['depth'][start:end]
+        is_mate = np.abs(values) >= MATE_OFFSET
+        mates = np.where(values > 0, values - MATE_OFFSET, values + MATE_OFFSET)
+        payloads = []
+        for value, mate, depth, mated in zip(values.tolist(), mates.tolist(), depths.tolist(), is_mate.tolist()):
+            if value == NO_EVAL:
+                payloads.append(None)
+            else:
+                payloads.append({'cp': None if mated else value, 'mate': mate if mated else None,
+                                 'depth': None if depth == NO_DEPTH else depth})
+        return payloads
+
+    def subtree(self, index, node_id, path_id):
+        # The D3 tree below a node straight from the node table, without materialising any node
+        start, end = index + 1, int(self.nodes[index]['end'])
+        moves = self.nodes['move'][start:end].tolist()
+        parents = self.nodes['parent'][start:end].tolist()
+        evals = self.eval_payloads(start, end)
+        children = {index: []}
+        ids = {index: node_id}
+        for position, code, parent, evaluation in zip(range(start, end), moves, parents, evals):
+            name = uci_name(code)
+            ids[position] = path_id(ids[parent], name)
+            child = {'id': ids[position], 'name': name, 'children': []}
+            if evaluation is not None:
+                child['eval'] = evaluation
+            children[parent].append(child)
+            children[position] = child['children']
+        return children[index]
+
+    def to_pgn(self):
+        return str(self.game())
+